@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the keytransfer hot paths.
+
+Every case reports ops/sec and the peak memory allocated by one call (traced
+with tracemalloc). Results are compared against a stored baseline and the run
+fails when a case gets slower than the baseline by more than `--threshold`.
+
+    python benchmarks/bench_keytransfer.py --save       # record or update the baseline
+    python benchmarks/bench_keytransfer.py              # compare against it
+    python benchmarks/bench_keytransfer.py -k poseidon  # only matching cases
+
+The baseline is machine specific, so record it on the machine that runs the
+comparison. Prover cases are skipped when libkeytransfer cannot be loaded, and
+the `crypto` signing case when its dependencies are not installed.
+
+`--backend python|gmpy2` selects the field arithmetic backend, and each backend
+is compared against its own baseline file. `--compare-backends` runs every case
+on both backends and prints the gmpy2 speedup.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from collections import namedtuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+BASELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+ZKEY = os.environ.get('KEYTRANSFER_ZKEY', '/usr/local/share/keytransfer/keytransfer.zkey')
+DAT = os.environ.get('KEYTRANSFER_DAT', '/usr/local/share/keytransfer/keytransfer.dat')
+
+X = 0x1d5ac1f31407f4fc1e3a9bb6a4c4ea2d7b7ba69af1d4d86cd5f0b4d69c11aa53
+KEY = b"123456789q01234567890q1234567890"
+SECRET = "abc123"
+
+Account = namedtuple('Account', ['key_file', 'password', 'address'])
+ACCOUNT = Account(os.path.join(ROOT, 'tests/resources/data/publisher_key_file.json'), 'node0',
+                  '0x00bd138abd70e2f00903268f3db08f2d25677c9e')
+
+
+def keytransfer_cases(kt):
+    point = kt.mulPointEscalar(kt.base8, 3)
+    sig = kt.sign(SECRET, X)
+    pub = kt.make_keypair(SECRET).pub
+    signed = [(kt.make_keypair(SECRET + str(i)).pub, X + i, kt.sign(SECRET + str(i), X + i))
+              for i in range(16)]
+    keys = [bytes([i]) * 32 for i in range(64)]
+
+    cases = []
+    for n in [1, 2, 5, 8, 14]:
+        inputs = [(X + i) % kt.F for i in range(n)]
+        cases.append((f'poseidon/arity={n}', lambda inputs=inputs: kt.poseidon(inputs)))
+    batch = [[X + i, i] for i in range(64)]
+    cases.append(('poseidon_many/arity=2/n=64', lambda: list(kt.poseidon_many(batch))))
+    cases.append(('mimc', lambda: kt.mimc(X, X + 1, X + 2)))
+    cases.append(('mimc_encrypt/1KiB', lambda: kt.mimc_encrypt(KEY * 32, X)))
+    for bits in [64, 128, 254]:
+        e = (1 << (bits - 1)) | X % (1 << (bits - 1))
+        cases.append((f'mulPointEscalar/bits={bits}', lambda e=e: kt.mulPointEscalar(point, e)))
+        cases.append((f'mulBase8Escalar/bits={bits}', lambda e=e: kt.mulBase8Escalar(e)))
+    cases.append(('hash_key', lambda: kt.hash_key(KEY)))
+    cases.append(('hash_keys/n=64', lambda: list(kt.hash_keys(keys))))
+    cases.append(('sign', lambda: kt.sign(SECRET, X)))
+    cases.append(('verify', lambda: kt.verify(pub, X, sig)))
+    cases.append(('verify_batch/n=16', lambda: kt.verify_batch(signed)))
+    cases.append(('prepare_transfer', lambda: kt.prepare_transfer(point, X, KEY)))
+    return cases
+
+
+def prover_cases(kt):
+    try:
+        prover = kt.make_prover(ZKEY, DAT)
+    except OSError as e:
+        print(f'skipping prover cases: {e}')
+        return []
+    point = kt.mulPointEscalar(kt.base8, 123)
+    return [('prove_transfer', lambda: kt.prove_transfer(prover, point, 234, KEY))]
+
+
+def crypto_cases():
+    try:
+        from common_utils_py.utils import crypto
+    except ImportError as e:
+        print(f'skipping crypto cases: {e}')
+        return []
+    crypto.warm_message_signers([ACCOUNT])
+    return [('sign_message', lambda: crypto.sign_message('benchmark token', ACCOUNT))]
+
+
+def measure(fn, min_time):
+    fn()
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=3, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'ops_per_sec': 1.0 / best, 'peak_bytes': peak}
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['ops_per_sec'] / base['ops_per_sec']
+        if ratio < 1.0 - threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def compare_backends(argv):
+    results = {}
+    for backend in ['python', 'gmpy2']:
+        env = dict(os.environ, KEYTRANSFER_FIELD_BACKEND=backend)
+        with tempfile.NamedTemporaryFile(suffix='.json') as out:
+            subprocess.run([sys.executable, __file__, '--json', out.name] + argv, env=env, check=True)
+            with open(out.name) as f:
+                results[backend] = json.load(f)
+    for name, result in results['python'].items():
+        fast = results['gmpy2'].get(name)
+        if fast:
+            print(f"{name:32} {fast['ops_per_sec'] / result['ops_per_sec']:6.2f}x with gmpy2")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', choices=['python', 'gmpy2'], help='field arithmetic backend')
+    parser.add_argument('--compare-backends', action='store_true',
+                        help='run on both backends and report the gmpy2 speedup')
+    parser.add_argument('--json', help=argparse.SUPPRESS)
+    parser.add_argument('--baseline', help='baseline JSON file (default benchmarks/baseline-<backend>.json)')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown against the baseline, as a fraction (default 0.25)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timing run')
+    parser.add_argument('-k', dest='pattern', help='only run cases whose name contains this')
+    args = parser.parse_args()
+
+    if args.compare_backends:
+        argv = ['--min-time', str(args.min_time)] + (['-k', args.pattern] if args.pattern else [])
+        return compare_backends(argv)
+    if args.backend:
+        os.environ['KEYTRANSFER_FIELD_BACKEND'] = args.backend
+    from common_utils_py.utils import field_backend, keytransfer
+    if args.backend and field_backend.NAME != args.backend:
+        print(f'field backend {args.backend} is not available')
+        return 1
+    print(f'field backend: {field_backend.NAME}')
+    if not args.baseline:
+        args.baseline = os.path.join(BASELINE_DIR, f'baseline-{field_backend.NAME}.json')
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for name, fn in keytransfer_cases(keytransfer) + prover_cases(keytransfer) + crypto_cases():
+        if args.pattern and args.pattern not in name:
+            continue
+        results[name] = result = measure(fn, args.min_time)
+        line = f"{name:32} {result['ops_per_sec']:12.1f} ops/s {result['peak_bytes'] / 1024:10.1f} KiB"
+        if name in baseline:
+            line += f"   {result['ops_per_sec'] / baseline[name]['ops_per_sec']:6.2f}x baseline"
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f)
+        return 0
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'baseline saved to {args.baseline}')
+        return 0
+
+    if not baseline:
+        print(f'no baseline at {args.baseline}, run with --save to record one')
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name, ratio in regressions:
+        print(f'REGRESSION {name}: {ratio:.2f}x baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
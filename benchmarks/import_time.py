@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark for the Poseidon constants.
+
+Each measurement runs in a fresh interpreter (after a warm-up run so that the
+bytecode cache is populated) and the best of `--repeat` runs is reported.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --legacy-rev 2a442bd
+
+`--legacy-rev` extracts `poseidon_constants.py` from the given git revision, when
+it was still an 886 KB dict literal, and times importing it for comparison.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CASES = [
+    ('import poseidon_constants',
+     'from common_utils_py.utils import poseidon_constants'),
+    ('import + load t=3,6',
+     'from common_utils_py.utils import poseidon_constants; '
+     'poseidon_constants.load(3); poseidon_constants.load(6)'),
+    ('import keytransfer',
+     'from common_utils_py.utils import keytransfer'),
+]
+
+
+def time_statement(statement, path, repeat):
+    code = ('import time; _t = time.perf_counter(); ' + statement +
+            '; print(time.perf_counter() - _t)')
+    env = dict(os.environ, PYTHONPATH=path)
+    subprocess.run([sys.executable, '-c', statement], env=env, check=True)
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                             capture_output=True, text=True).stdout
+        runs.append(float(out))
+    return min(runs)
+
+
+def legacy_module(rev, directory):
+    source = subprocess.run(
+        ['git', 'show', f'{rev}:common_utils_py/utils/poseidon_constants.py'],
+        cwd=ROOT, check=True, capture_output=True).stdout
+    with open(os.path.join(directory, 'legacy_poseidon_constants.py'), 'wb') as f:
+        f.write(source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--legacy-rev', help='git revision with the dict-literal constants module')
+    args = parser.parse_args()
+
+    results = []
+    if args.legacy_rev:
+        with tempfile.TemporaryDirectory() as directory:
+            legacy_module(args.legacy_rev, directory)
+            results.append((f'import dict literal ({args.legacy_rev})',
+                            time_statement('import legacy_poseidon_constants', directory, args.repeat)))
+    for name, statement in CASES:
+        try:
+            results.append((name, time_statement(statement, ROOT, args.repeat)))
+        except subprocess.CalledProcessError:
+            results.append((name, None))
+
+    for name, seconds in results:
+        value = 'failed' if seconds is None else f'{seconds * 1000:9.2f} ms'
+        print(f'{name:40} {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Per-call microbenchmark for the keytransfer field arithmetic.
+
+    python benchmarks/keytransfer_micro.py
+    python benchmarks/keytransfer_micro.py --legacy-rev 2a442bd
+
+`--legacy-rev` loads `keytransfer.py` from the given git revision next to the
+current one and reports the speedup of each call.
+"""
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from common_utils_py.utils import keytransfer  # noqa: E402
+
+X = 0x1d5ac1f31407f4fc1e3a9bb6a4c4ea2d7b7ba69af1d4d86cd5f0b4d69c11aa53
+Y = 0x0be4d0b0a9bfc0b36e0cb4c1e5b6f3e91d7fc61ea8e2d6c0c2e3d9f4ba21e0d7
+K = 2 ** 250 + 12345
+
+
+def cases(kt):
+    P = kt.mulPointEscalar(kt.base8, 3)
+    return [
+        ('pow5', lambda: kt.pow5(X)),
+        ('addPoint', lambda: kt.addPoint(P, kt.base8)),
+        ('poseidon t=3', lambda: kt.poseidon([X, Y])),
+        ('poseidon t=6', lambda: kt.poseidon([X, Y, X, Y, X])),
+        ('mimc', lambda: kt.mimc(X, Y, K)),
+        ('mulPointEscalar', lambda: kt.mulPointEscalar(P, K)),
+    ]
+
+
+def per_call(fn, min_time=0.2):
+    fn()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def load_legacy(rev, directory):
+    source = subprocess.run(
+        ['git', 'show', f'{rev}:common_utils_py/utils/keytransfer.py'],
+        cwd=ROOT, check=True, capture_output=True).stdout
+    path = os.path.join(directory, 'legacy_keytransfer.py')
+    with open(path, 'wb') as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location('legacy_keytransfer', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--legacy-rev', help='git revision to compare against')
+    args = parser.parse_args()
+
+    legacy = None
+    if args.legacy_rev:
+        with tempfile.TemporaryDirectory() as directory:
+            legacy = load_legacy(args.legacy_rev, directory)
+
+    current = cases(keytransfer)
+    before = dict(cases(legacy)) if legacy else {}
+    for name, fn in current:
+        after = per_call(fn)
+        line = f'{name:20} {after * 1e6:12.2f} us'
+        if name in before:
+            old = per_call(before[name])
+            line += f'   was {old * 1e6:12.2f} us   {old / after:6.2f}x'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
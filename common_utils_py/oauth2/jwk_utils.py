@@ -3,7 +3,7 @@
 This only works for EC curve secp256k1.
 """
 import base64
-from common_utils_py.utils.crypto import get_keys_from_file
+from common_utils_py.utils.crypto import get_key_material
 
 
 def key_bytes_to_jwk(public_key_bytes, private_key_bytes):
@@ -18,12 +18,13 @@ def key_bytes_to_jwk(public_key_bytes, private_key_bytes):
     return jwk_json
 
 
-def key_file_to_jwk(keyfile_path, password):
-    public_key_hex, private_key_hex = get_keys_from_file(keyfile_path, password)
-    private_key_bytes = bytes.fromhex(private_key_hex[2:])
-    public_key_bytes = bytes.fromhex(public_key_hex[2:])
-    
-    return key_bytes_to_jwk(public_key_bytes, private_key_bytes)
+def key_material_to_jwk(key_material):
+    return key_bytes_to_jwk(key_material.public_key, key_material.private_key)
+
+
+def key_file_to_jwk(keyfile_path, password=None):
+    """`keyfile_path` may also be a KeyMaterial, in which case `password` is not needed."""
+    return key_material_to_jwk(get_key_material(keyfile_path, password))
 
 
 def account_to_jwk(account):
@@ -1,5 +1,9 @@
 """Crypto Utils class"""
 import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 
 import rsa
 from Crypto import Random
@@ -8,49 +12,189 @@ from Crypto.Protocol.KDF import PBKDF2
 from ecies import decrypt, encrypt
 from eth_keys import keys
 from eth_utils import to_bytes, to_hex
+from hexbytes import HexBytes
 from web3.auto import w3
-from contracts_lib_py.wallet import Wallet
 from contracts_lib_py.utils import add_ethereum_prefix_and_hash_msg
 
 BLOCK_SIZE = 16
-pad = lambda s: s + (BLOCK_SIZE - len(s) % BLOCK_SIZE) * chr(BLOCK_SIZE - len(s) % BLOCK_SIZE)
+AES_KEY_CACHE_SIZE = 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+pad_bytes = lambda s: s + (BLOCK_SIZE - len(s) % BLOCK_SIZE) * bytes([BLOCK_SIZE - len(s) % BLOCK_SIZE])
 unpad = lambda s: s[:-ord(s[len(s) - 1:])]
 
 
-def get_keys_from_file(keyfile_path, keyfile_password):
-    with open(keyfile_path) as keyfile:
-        encrypted_key = keyfile.read()
-    private_key = w3.eth.account.decrypt(encrypted_key, keyfile_password)
-    pk = keys.PrivateKey(private_key)
+class KeyMaterial:
+    """
+    Decrypted secp256k1 key pair of an Ethereum keystore file.
+
+    Accepted by the ECIES and JWK helpers in place of a keystore path and password.
+    """
+
+    def __init__(self, private_key):
+        pk = keys.PrivateKey(private_key)
+        self.private_key = pk.to_bytes()
+        self.public_key = pk.public_key.to_bytes()
+        self.private_key_hex = to_hex(self.private_key)
+        self.public_key_hex = to_hex(self.public_key)
+        self._signer = None
+
+    @property
+    def signer(self):
+        """MessageSigner for this key, created on first use."""
+        if self._signer is None:
+            self._signer = MessageSigner(self)
+        return self._signer
+
+    def __repr__(self):
+        return f'KeyMaterial(public_key={self.public_key_hex})'
+
+
+class KeystoreCache:
+    """
+    Process-wide, thread-safe cache of decrypted keystore files.
+
+    Entries are keyed by (path, mtime, password digest), so a rewritten keystore
+    or a different password decrypts again, and the password itself is not kept.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, keyfile_path, keyfile_password):
+        if keyfile_password is None:
+            raise ValueError(f'A password is required to decrypt the keystore {keyfile_path}')
+        path = os.path.abspath(keyfile_path)
+        password = keyfile_password.encode('utf-8') if isinstance(keyfile_password, str) \
+            else keyfile_password
+        key = (path, os.stat(path).st_mtime_ns, hashlib.sha256(password).digest())
+        with self._lock:
+            material = self._entries.get(key)
+        if material is None:
+            with open(path) as keyfile:
+                encrypted_key = keyfile.read()
+            material = KeyMaterial(w3.eth.account.decrypt(encrypted_key, keyfile_password))
+            with self._lock:
+                for stale in [k for k in self._entries if k[0] == path and k[1] != key[1]]:
+                    del self._entries[stale]
+                self._entries[key] = material
+        return material
+
+    def invalidate(self, keyfile_path=None):
+        """
+        Drop the cached keys of `keyfile_path`, or every cached key if it is None.
+        """
+        with self._lock:
+            if keyfile_path is None:
+                self._entries.clear()
+                return
+            path = os.path.abspath(keyfile_path)
+            for key in [k for k in self._entries if k[0] == path]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+keystore_cache = KeystoreCache()
+
+
+def get_key_material(keyfile, keyfile_password=None):
+    """
+    Return the decrypted keys of a keystore file, through `keystore_cache`.
+
+    :param keyfile: keystore path, or a KeyMaterial which is returned as is
+    :param keyfile_password: keystore password, str, required with a path
+    :return: KeyMaterial
+    """
+    if isinstance(keyfile, KeyMaterial):
+        return keyfile
+    return keystore_cache.get(keyfile, keyfile_password)
 
-    private_key_hex = to_hex(private_key)  # hex string
-    public_key_hex = to_hex(pk.public_key._raw_key)  # hex string
 
-    return public_key_hex, private_key_hex
+def get_keys_from_file(keyfile_path, keyfile_password):
+    material = get_key_material(keyfile_path, keyfile_password)
+    return material.public_key_hex, material.private_key_hex
 
 
 def get_ecdsa_public_key_from_file(keyfile_path, keyfile_password):
-    with open(keyfile_path) as keyfile:
-        encrypted_key = keyfile.read()
-    private_key = w3.eth.account.decrypt(encrypted_key, keyfile_password)
-    pk = keys.PrivateKey(private_key)
-
-    return to_hex(pk.public_key._raw_key)  # hex string
+    return get_key_material(keyfile_path, keyfile_password).public_key_hex
 
 
-def ecdsa_encryption_from_file(message, provider_key_file, provider_password):
+def ecdsa_encryption_from_file(message, provider_key_file, provider_password=None):
     public_key_hex = get_ecdsa_public_key_from_file(provider_key_file, provider_password)
     encrypted_message = encryption(public_key_hex, message.encode())
     hash = to_hex(encrypted_message)
     return hash, public_key_hex
 
 
-def ecdsa_decryption(message, provider_key_file, provider_password):
-    (public_key_hex, private_key_hex) = get_keys_from_file(provider_key_file, provider_password)
-    result = decryption(private_key_hex, to_bytes(hexstr=message))
+def ecdsa_decryption(message, provider_key_file, provider_password=None):
+    material = get_key_material(provider_key_file, provider_password)
+    result = decryption(material, to_bytes(hexstr=message))
     return result.decode()
 
 
+class KeyFileCache:
+    """
+    Process-wide, thread-safe cache of key files and the values parsed from them.
+
+    Each file is read once per modification time; the parsed values (RSA keys,
+    PEM bodies) are kept next to its content and dropped when the file changes.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, keyfile_path, parse):
+        """
+        Return `parse(content)` for the current content of `keyfile_path`.
+
+        :param keyfile_path: str
+        :param parse: function of the file content, bytes, used as cache key too
+        """
+        path = os.path.abspath(keyfile_path)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime and parse in entry[2]:
+                return entry[2][parse]
+        if entry is None or entry[0] != mtime:
+            with open(path, mode='rb') as keyfile:
+                entry = (mtime, keyfile.read(), {})
+        value = parse(entry[1])
+        with self._lock:
+            current = self._entries.get(path)
+            if current is not None and current[0] == mtime:
+                entry = current
+            entry[2][parse] = value
+            self._entries[path] = entry
+        return value
+
+    def invalidate(self, keyfile_path=None):
+        """
+        Drop the cached content of `keyfile_path`, or of every file if it is None.
+        """
+        with self._lock:
+            if keyfile_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(keyfile_path), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+key_file_cache = KeyFileCache()
+
+
+def _public_key_body(key_content):
+    return key_content.decode().replace('-----BEGIN PUBLIC KEY-----', '') \
+        .replace('-----END PUBLIC KEY-----', '') \
+        .replace('\r', '') \
+        .replace('\n', '')
+
+
 def rsa_encryption_from_file(message, rsa_public_key_file):
     pub_key = get_rsa_public_key_from_file(rsa_public_key_file)
     encrypted_message, aes_encrypted_key = rsa_encryption(pub_key, message.encode())
@@ -59,81 +203,250 @@ def rsa_encryption_from_file(message, rsa_public_key_file):
 
 
 def get_content_keyfile_from_path(keyfile_path):
-    with open(keyfile_path, mode='r') as keyfile:
-        key_content = keyfile.read()
-
-    return key_content.replace('-----BEGIN PUBLIC KEY-----', '') \
-        .replace('-----END PUBLIC KEY-----', '') \
-        .replace('\n', '')
+    return key_file_cache.get(keyfile_path, _public_key_body)
 
 
 def get_rsa_public_key_from_file(keyfile_path):
-    with open(keyfile_path, mode='rb') as keyfile:
-        key_content = keyfile.read()
-    return rsa.PublicKey.load_pkcs1_openssl_pem(key_content)
+    return key_file_cache.get(keyfile_path, rsa.PublicKey.load_pkcs1_openssl_pem)
 
 
 def get_rsa_private_key_from_file(keyfile_path):
-    with open(keyfile_path, mode='rb') as keyfile:
-        key_content = keyfile.read()
-    return rsa.PrivateKey.load_pkcs1(key_content)
+    return key_file_cache.get(keyfile_path, rsa.PrivateKey.load_pkcs1)
 
 
 def rsa_encryption(public_key, data):
     aes_key = rsa.randnum.read_random_bits(128)
-    encrypted_data = aes_encryption(data, aes_key)
+    # a fresh key per message, not worth a slot in the AES key cache
+    encrypted_data = AESCipher(aes_key, cached=False).encrypt(data)
     encrypted_aes_key = rsa.encrypt(aes_key, public_key)
     return encrypted_data, encrypted_aes_key
 
 
+def rsa_encryption_stream(public_key, source, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streaming version of `rsa_encryption`, see `AESCipher.encrypt_stream`.
+
+    :return: tuple of (iterator of encrypted chunks, RSA encrypted AES key)
+    """
+    aes_key = rsa.randnum.read_random_bits(128)
+    encrypted_chunks = AESCipher(aes_key, cached=False).encrypt_stream(source, chunk_size)
+    return encrypted_chunks, rsa.encrypt(aes_key, public_key)
+
+
+def rsa_decryption_stream(private_key, source, encrypted_aes_key, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streaming version of `rsa_decryption`, see `AESCipher.decrypt_stream`.
+
+    :return: iterator of decrypted chunks
+    """
+    aes_key = rsa.decrypt(encrypted_aes_key, private_key)
+    return AESCipher(aes_key, cached=False).decrypt_stream(source, chunk_size)
+
+
 def rsa_decryption_aes(message, rsa_private_key_file):
+    priv_key = get_rsa_private_key_from_file(rsa_private_key_file)
     if '|' in message:  # The message includes an encrypted AES key
         tokens = message.split('|')
-        return rsa_decryption(get_rsa_private_key_from_file(rsa_private_key_file),
-                              to_bytes(hexstr=tokens[0]), to_bytes(hexstr=tokens[1]))
-    priv_key = get_rsa_private_key_from_file(rsa_private_key_file)
+        return rsa_decryption(priv_key, to_bytes(hexstr=tokens[0]), to_bytes(hexstr=tokens[1]))
     result = rsa.decrypt(to_bytes(hexstr=message), priv_key)
     return result.decode()
 
 
 def rsa_decryption(private_key, encrypted_data, encrypted_aes_key):
     aes_key = rsa.decrypt(encrypted_aes_key, private_key)
-    return aes_decryption(encrypted_data, aes_key)
+    # one-off session key, kept out of the AES key cache
+    return AESCipher(aes_key, cached=False).decrypt(encrypted_data)
 
 
-def get_aes_private_key(passphrase):
+def derive_aes_private_key(passphrase):
     salt = b'this is a salt'
     kdf = PBKDF2(passphrase, salt, 64, 1000)
     key = kdf[:32]
     return key
 
 
+_aes_keys = OrderedDict()
+_aes_keys_lock = threading.Lock()
+
+
+def get_aes_private_key(passphrase):
+    """
+    Return the AES key derived from `passphrase`, memoized in a bounded LRU.
+
+    Entries are keyed by a SHA-256 digest of the passphrase, so the passphrases
+    themselves are not kept in memory.
+
+    :param passphrase: str or bytes
+    :return: 32-byte key
+    """
+    is_str = isinstance(passphrase, str)
+    digest = (is_str, hashlib.sha256(passphrase.encode('utf-8') if is_str else passphrase).digest())
+    with _aes_keys_lock:
+        key = _aes_keys.get(digest)
+        if key is not None:
+            _aes_keys.move_to_end(digest)
+            return key
+    key = derive_aes_private_key(passphrase)
+    with _aes_keys_lock:
+        _aes_keys[digest] = key
+        while len(_aes_keys) > AES_KEY_CACHE_SIZE:
+            _aes_keys.popitem(last=False)
+    return key
+
+
+class AESCipher:
+    """
+    Holds the AES key derived from one passphrase, so that repeated encryptions
+    and decryptions pay the key derivation once.
+    """
+
+    def __init__(self, passphrase, cached=True):
+        self.key = get_aes_private_key(passphrase) if cached else derive_aes_private_key(passphrase)
+
+    def encrypt(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        iv = Random.new().read(AES.block_size)
+        cipher = AES.new(self.key, AES.MODE_CBC, iv)
+        return base64.b64encode(iv + cipher.encrypt(pad_bytes(data)))
+
+    def decrypt(self, encrypted_data):
+        encrypted_data = base64.b64decode(encrypted_data)
+        iv = encrypted_data[:16]
+        cipher = AES.new(self.key, AES.MODE_CBC, iv)
+        return unpad(cipher.decrypt(encrypted_data[16:]))
+
+    def encrypt_stream(self, source, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Encrypt a file-like object or an iterator of byte chunks in constant memory.
+
+        The yielded chunks join to the raw `iv + ciphertext`, which base64 encoded
+        is what `encrypt` returns for the same data and IV.
+
+        :param source: binary file-like object or iterable of bytes
+        :param chunk_size: read size for file-like objects, int
+        :return: iterator of bytes
+        """
+        iv = Random.new().read(AES.block_size)
+        cipher = AES.new(self.key, AES.MODE_CBC, iv)
+        yield iv
+        pending = b''
+        for chunk in _iter_chunks(source, chunk_size):
+            pending += chunk
+            n = len(pending) - len(pending) % BLOCK_SIZE
+            if n:
+                yield cipher.encrypt(pending[:n])
+                pending = pending[n:]
+        yield cipher.encrypt(pad_bytes(pending))
+
+    def decrypt_stream(self, source, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Decrypt the output of `encrypt_stream` in constant memory.
+
+        :param source: binary file-like object or iterable of bytes
+        :param chunk_size: read size for file-like objects, int
+        :return: iterator of bytes
+        """
+        cipher = None
+        pending = b''
+        for chunk in _iter_chunks(source, chunk_size):
+            pending += chunk
+            if cipher is None:
+                if len(pending) < BLOCK_SIZE:
+                    continue
+                cipher = AES.new(self.key, AES.MODE_CBC, pending[:BLOCK_SIZE])
+                pending = pending[BLOCK_SIZE:]
+            # hold back the last full block, it carries the padding
+            n = len(pending) - len(pending) % BLOCK_SIZE
+            if n == len(pending):
+                n -= BLOCK_SIZE
+            if n > 0:
+                yield cipher.decrypt(pending[:n])
+                pending = pending[n:]
+        if cipher is None or len(pending) != BLOCK_SIZE:
+            raise ValueError('Encrypted stream is truncated')
+        last = cipher.decrypt(pending)
+        if not 1 <= last[-1] <= BLOCK_SIZE or last[-last[-1]:] != bytes([last[-1]]) * last[-1]:
+            raise ValueError('Invalid padding in encrypted stream')
+        yield unpad(last)
+
+
+def _iter_chunks(source, chunk_size):
+    if not hasattr(source, 'read'):
+        yield from source
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
 def aes_encryption(data, passphrase):
-    data = data.decode()
-    private_key = get_aes_private_key(passphrase)
-    data = pad(data).encode()
-    iv = Random.new().read(AES.block_size)
-    cipher = AES.new(private_key, AES.MODE_CBC, iv)
-    return base64.b64encode(iv + cipher.encrypt(data))
+    return AESCipher(passphrase).encrypt(data)
 
 
 def aes_decryption(encrypted_data, passphrase):
-    private_key = get_aes_private_key(passphrase)
-    encrypted_data = base64.b64decode(encrypted_data)
-    iv = encrypted_data[:16]
-    cipher = AES.new(private_key, AES.MODE_CBC, iv)
-    return unpad(cipher.decrypt(encrypted_data[16:]))
+    return AESCipher(passphrase).decrypt(encrypted_data)
+
+
+def aes_encryption_stream(source, passphrase, chunk_size=STREAM_CHUNK_SIZE):
+    return AESCipher(passphrase).encrypt_stream(source, chunk_size)
+
+
+def aes_decryption_stream(source, passphrase, chunk_size=STREAM_CHUNK_SIZE):
+    return AESCipher(passphrase).decrypt_stream(source, chunk_size)
 
 
 def encryption(public_key_hex, data):
+    if isinstance(public_key_hex, KeyMaterial):
+        public_key_hex = public_key_hex.public_key_hex
     return encrypt(public_key_hex, data)
 
 
 def decryption(private_key_hex, encrypted_data):
+    if isinstance(private_key_hex, KeyMaterial):
+        private_key_hex = private_key_hex.private_key_hex
     return decrypt(private_key_hex, encrypted_data)
 
 
+class MessageSigner:
+    """
+    Signs Ethereum-prefixed messages with one decrypted key, giving the same
+    signatures as `contracts_lib_py.wallet.Wallet.sign`.
+    """
+
+    def __init__(self, key_material):
+        self._key = keys.PrivateKey(key_material.private_key)
+        self.address = self._key.public_key.to_checksum_address()
+
+    def sign_hash(self, msg_hash):
+        """
+        :param msg_hash: 32-byte message hash
+        :return: 65-byte r || s || v signature with v in {27, 28}, HexBytes
+        """
+        signature = self._key.sign_msg_hash(bytes(msg_hash))
+        return HexBytes(signature.to_bytes()[:64] + bytes([signature.v + 27]))
+
+    def sign(self, signature_input):
+        return self.sign_hash(add_ethereum_prefix_and_hash_msg(signature_input))
+
+
+def get_message_signer(account):
+    """
+    Return the cached MessageSigner of `account`, decrypting its keystore on first use.
+
+    :param account: Account with `key_file` and `password`
+    :return: MessageSigner
+    """
+    return get_key_material(account.key_file, account.password).signer
+
+
+def warm_message_signers(accounts):
+    """Decrypt the keystores of `accounts` ahead of their first `sign_message`."""
+    for account in accounts:
+        get_message_signer(account)
+
+
 def sign_message(signature_input, account):
-    wallet =  Wallet(w3, account.key_file, account.password, account.address)
-    signature = wallet.sign(add_ethereum_prefix_and_hash_msg(signature_input))
-    return signature.signature
\ No newline at end of file
+    return get_message_signer(account).sign(signature_input)
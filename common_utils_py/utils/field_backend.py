@@ -0,0 +1,35 @@
+"""
+Big-integer backend for the keytransfer field arithmetic.
+
+`gmpy2` is used when it is installed, unless the environment variable
+KEYTRANSFER_FIELD_BACKEND is set to `python`; otherwise the arithmetic runs on
+plain Python ints. The backend is selected once, at import.
+"""
+import os
+
+NAME = 'python'
+
+
+def mpz(a):
+    return int(a)
+
+
+def invert(a, m):
+    """Inverse of `a` modulo the prime `m`, 0 when `a` is 0 mod `m`."""
+    return pow(a, m - 2, m)
+
+
+if os.environ.get('KEYTRANSFER_FIELD_BACKEND', 'gmpy2') != 'python':
+    try:
+        import gmpy2
+    except ImportError:
+        gmpy2 = None
+
+    if gmpy2 is not None:
+        NAME = 'gmpy2'
+        mpz = gmpy2.mpz
+
+        def invert(a, m):
+            """Inverse of `a` modulo the prime `m`, 0 when `a` is 0 mod `m`."""
+            # gmpy2.invert raises on 0; match the Fermat inverse of the python backend
+            return gmpy2.invert(a, m) if a % m else gmpy2.mpz(0)
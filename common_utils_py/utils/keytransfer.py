@@ -1,90 +1,440 @@
-from common_utils_py.utils.poseidon_constants import constants
+from common_utils_py.utils import field_backend, poseidon_constants
 from common_utils_py.utils.mimc_constants import mimc_constants
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from ctypes import *
+from functools import lru_cache
+import hashlib
 import json
+import os
+import secrets
+import tempfile
+import threading
+import time
 from web3 import Web3
 
+_mpz = field_backend.mpz
+_invert = field_backend.invert
+
+# Field elements run on the backend selected in `field_backend` (gmpy2 when
+# installed) through the underscore-prefixed names; the public constants and
+# helpers take and return plain ints on either backend.
 F = 21888242871839275222246405745257275088548364400416034343698204186575808495617
+_F = _mpz(F)
 
 N_ROUNDS_F = 8
 N_ROUNDS_P = [56, 57, 56, 60, 60, 63, 64, 63, 60, 66, 60, 65, 70, 60, 64, 68]
 
 def C(a,b):
-    return int(constants['C'][a][b], 16)
+    return int(get_poseidon_hasher(a + 2).C[b])
 
 def M(a,b,c):
-    return int(constants['M'][a][b][c], 16)
+    return int(get_poseidon_hasher(a + 2).M[b][c])
+
+# The helpers below reduce their result mod F, but accept unreduced ints, so hot
+# loops can add or multiply several terms and reduce once per row or round,
+# e.g. `_dot(row, state)` or `_pow5(state[0] + c)`.
+
+def _square(a):
+    return (a * a) % _F
+
+def _pow5(a):
+    a2 = (a * a) % _F
+    return (a2 * a2 % _F) * a % _F
+
+def _dot(row, vec):
+    return sum(m * v for m, v in zip(row, vec)) % _F
+
+def _mul(a,b):
+    return (a*b) % _F
+
+def _div(a,b):
+    return _mul(a, _invert(b % _F, _F))
 
 def square(a):
-    return (a ** 2) % F
+    return int(_square(a))
 
 def pow5(a):
-    return (a ** 5) % F
+    return int(_pow5(a))
+
+def dot(row, vec):
+    return int(_dot(row, vec))
 
 def add(a,b):
-    return (a+b) % F
+    return int((a+b) % _F)
 
 def sub(a,b):
-    return (a-b + F) % F
+    return int((a-b + _F) % _F)
 
 def div(a,b):
-    return mul(a, pow(b, F-2, F))
+    return int(_div(a, b))
 #    return mul(a, pow(b, -1, F))
 
 def mul(a,b):
-    return (a*b) % F
+    return int(_mul(a, b))
+
+def _solve(A, b):
+    """Solve A x = b over the field by Gauss-Jordan elimination."""
+    n = len(A)
+    rows = [list(A[i]) + [b[i]] for i in range(n)]
+    for col in range(n):
+        pivot = next(i for i in range(col, n) if rows[i][col] % _F != 0)
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        inv = _invert(rows[col][col], _F)
+        rows[col] = [(v * inv) % _F for v in rows[col]]
+        for i in range(n):
+            if i != col and rows[i][col]:
+                f = rows[i][col]
+                rows[i] = [(v - f * p) % _F for v, p in zip(rows[i], rows[col])]
+    return [row[n] for row in rows]
+
+class PoseidonHasher:
+    """
+    Poseidon hash for a fixed state width `t` (number of inputs + 1).
+
+    The round constants and the MDS matrix are loaded once from the packed
+    constants table into native ints, so a hasher can be reused for any number
+    of hashes.
+
+    `hash` and `hash_many` use the optimised schedule in which the partial rounds
+    multiply by sparse matrices, at O(t) cost per round instead of O(t^2), while
+    `hash_reference` runs the plain round-by-round permutation.
+    """
+
+    def __init__(self, t):
+        assert(2 <= t <= len(N_ROUNDS_P) + 1)
+        self.t = t
+        self.n_rounds_f = N_ROUNDS_F
+        self.n_rounds_p = N_ROUNDS_P[t - 2]
+        C, M = poseidon_constants.load(t)
+        self.C = [_mpz(c) for c in C]
+        self.M = [[_mpz(m) for m in row] for row in M]
+        self._optimized = None
+
+    def _optimized_tables(self):
+        """
+        Precompute the constants of the optimised schedule.
+
+        In a partial round only state[0] goes through the S-box, so the other
+        round constant entries can be pushed through the MDS matrix into the next
+        round, leaving a single scalar constant per partial round. The MDS matrix
+        of each partial round is then factored as M = A * B, where
+        B = diag(1, M_hat) is applied first and A is sparse: a dense first row,
+        a dense first column and the identity elsewhere. B leaves state[0]
+        untouched, so it commutes with the partial S-box and the scalar constant
+        and can be folded into the matrix of the previous round. Folding from the
+        last partial round backwards leaves one dense matrix P, used by the last
+        full round before the partial rounds.
+        """
+        if self._optimized is not None:
+            return self._optimized
+        t = self.t
+        C = self.C
+        M = self.M
+        half_f = self.n_rounds_f // 2
+        n_rounds_p = self.n_rounds_p
+        rng = range(0, t)
+
+        round_c = [C[r * t:(r + 1) * t] for r in range(0, self.n_rounds_f + n_rounds_p)]
+        partial_c = []
+        carry = [0] * t
+        for r in range(half_f, half_f + n_rounds_p):
+            eff = [(c + k) % _F for c, k in zip(round_c[r], carry)]
+            partial_c.append(eff[0])
+            rest = [0] + eff[1:]
+            carry = [sum(m * v for m, v in zip(row, rest)) % _F for row in M]
+        first = half_f + n_rounds_p
+        round_c[first] = [(c + k) % _F for c, k in zip(round_c[first], carry)]
+        full_c = round_c[:half_f] + round_c[first:]
+
+        sparse = []
+        X = M
+        for _ in range(0, n_rounds_p):
+            X_hat = [row[1:] for row in X[1:]]
+            X_hat_t = [list(col) for col in zip(*X_hat)]
+            u = _solve(X_hat_t, X[0][1:])
+            w = [row[0] for row in X[1:]]
+            sparse.append((X[0][0], u, w))
+            X = [M[0]] + [[sum(X_hat[k][j - 1] * M[j][i] for j in range(1, t)) % _F for i in rng]
+                          for k in range(0, t - 1)]
+        sparse.reverse()
+
+        self._optimized = (full_c, partial_c, X, sparse)
+        return self._optimized
+
+    def hash_reference(self, inputs):
+        t = self.t
+        assert(len(inputs) == t - 1)
+        C = self.C
+        M = self.M
+        half_f = self.n_rounds_f // 2
+        n_rounds_p = self.n_rounds_p
+        rng = range(0, t)
+
+        state = [0] + list(inputs)
+        for r in range(0, self.n_rounds_f + n_rounds_p):
+            c = r * t
+            state = [(state[i] + C[c + i]) % _F for i in rng]
+
+            if (r < half_f or r >= half_f + n_rounds_p):
+                state = [pow(s, 5, _F) for s in state]
+            else:
+                state[0] = pow(state[0], 5, _F)
+
+            state = [sum(m * s for m, s in zip(row, state)) % _F for row in M]
+        return int(state[0] % _F)
+
+    def hash(self, inputs):
+        t = self.t
+        assert(len(inputs) == t - 1)
+        return int(self._rounds([0] + list(inputs), 0)[0])
+
+    def _rounds(self, state, first):
+        # full rounds `first`.. on the state left by round first - 1, with the
+        # partial rounds folded in after the first half
+        full_c, _, P, _ = self._optimized_tables()
+        M = self.M
+        half_f = self.n_rounds_f // 2
+        for r in range(first, self.n_rounds_f):
+            state = [_pow5(s + c) for s, c in zip(state, full_c[r])]
+            mds = P if r == half_f - 1 else M
+            state = [_dot(row, state) for row in mds]
+            if r == half_f - 1:
+                state = self._partial_rounds(state)
+        return state
+
+    def _partial_rounds(self, state):
+        _, partial_c, _, sparse = self._optimized_tables()
+        for c, (a00, u, w) in zip(partial_c, sparse):
+            s0 = _pow5(state[0] + c)
+            rest = state[1:]
+            state = [(a00 * s0 + sum(a * s for a, s in zip(u, rest))) % _F] + \
+                    [(k * s0 + s) % _F for k, s in zip(w, rest)]
+        return state
+
+    def specialize(self, fixed):
+        """
+        Return a hash function for inputs of which some positions are constant.
+
+        The first round S-boxes and matrix products that only involve the
+        constant inputs are evaluated once here.
+
+        :param fixed: dict of input position -> value
+        :return: function of the list of remaining inputs, in order, returning the hash, int
+        """
+        assert(all(0 <= i < self.t - 1 for i in fixed))
+        full_c, _, P, _ = self._optimized_tables()
+        first_partial = self.n_rounds_f // 2 == 1
+        mds = P if first_partial else self.M
+        # state lane 0 is the zero capacity element, input i is lane i + 1
+        fixed_lanes = {0: 0, **{i + 1: v for i, v in fixed.items()}}
+        sboxes = [(lane, _pow5(v + full_c[0][lane])) for lane, v in fixed_lanes.items()]
+        base = [sum(row[lane] * s for lane, s in sboxes) % _F for row in mds]
+        lanes = [lane for lane in range(1, self.t) if lane not in fixed_lanes]
+        columns = [[row[lane] for lane in lanes] for row in mds]
+        lane_c = [full_c[0][lane] for lane in lanes]
+
+        def hash_rest(inputs):
+            assert(len(inputs) == len(lanes))
+            s = [_pow5(x + c) for x, c in zip(inputs, lane_c)]
+            state = [(b + sum(m * v for m, v in zip(column, s))) % _F for b, column in zip(base, columns)]
+            if first_partial:
+                state = self._partial_rounds(state)
+            return int(self._rounds(state, 1)[0])
+        return hash_rest
+
+    def hash_many(self, batch):
+        """
+        Hash a batch of inputs of this hasher's arity in lockstep.
+
+        The state is kept column-wise so that each round constant and matrix row
+        is looked up once per round for the whole batch.
+
+        :param batch: list of inputs, each a list of t - 1 ints
+        :return: list of hashes in input order, int[]
+        """
+        t = self.t
+        if not batch:
+            return []
+        assert(all(len(inputs) == t - 1 for inputs in batch))
+        full_c, partial_c, P, sparse = self._optimized_tables()
+        M = self.M
+        half_f = self.n_rounds_f // 2
+        rng = range(0, t)
+
+        cols = [[0] * len(batch)] + [list(col) for col in zip(*batch)]
+        for r in range(0, self.n_rounds_f):
+            round_c = full_c[r]
+            cols = [[_pow5(v + round_c[i]) for v in cols[i]] for i in rng]
+            mds = P if r == half_f - 1 else M
+            lanes = list(zip(*cols))
+            cols = [[_dot(row, lane) for lane in lanes] for row in mds]
+
+            if r == half_f - 1:
+                for c, (a00, u, w) in zip(partial_c, sparse):
+                    s0 = [_pow5(v + c) for v in cols[0]]
+                    rest = cols[1:]
+                    lanes = list(zip(*rest))
+                    cols = [[(a00 * v + sum(a * s for a, s in zip(u, lane))) % _F
+                             for v, lane in zip(s0, lanes)]] + \
+                           [[(k * v + s) % _F for v, s in zip(s0, col)] for k, col in zip(w, rest)]
+        return [int(v) for v in cols[0]]
+
+
+@lru_cache(maxsize=None)
+def get_poseidon_hasher(t):
+    """
+    Return the shared `PoseidonHasher` for state width `t`, building it on first use.
+
+    :param t: state width, number of inputs + 1, int
+    :return: PoseidonHasher
+    """
+    return PoseidonHasher(t)
 
 def poseidon(inputs):
     assert(len(inputs) > 0)
     assert(len(inputs) < len(N_ROUNDS_P) - 1)
 
-    t = len(inputs) + 1
-    nRoundsF = N_ROUNDS_F
-    nRoundsP = N_ROUNDS_P[t - 2]
+    return get_poseidon_hasher(len(inputs) + 1).hash(inputs)
 
-    state = [0] + inputs
-    for r in range(0,nRoundsF + nRoundsP):
-        nstate = []
-        for i in range(0, len(state)):
-            nstate.append(add(state[i], C(t - 2,r * t + i)))
-        state = nstate
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-        if (r < nRoundsF / 2 or r >= nRoundsF / 2 + nRoundsP):
-            state = list(map(pow5, state))
-        else:
-            state[0] = pow5(state[0])
+def _poseidon_chunk(chunk):
+    return get_poseidon_hasher(len(chunk[0]) + 1).hash_many(chunk)
+
+def poseidon_many(inputs, processes=None, chunk_size=256):
+    """
+    Hash many same-arity inputs, yielding the hashes in input order.
+
+    Inputs are hashed in lockstep in chunks of `chunk_size`. When `processes` is
+    given the chunks are fanned out to a process pool, keeping at most two chunks
+    per worker in flight so that results can be streamed back as they complete.
+
+    :param inputs: iterable of inputs, each a list of ints
+    :param processes: number of worker processes, None to hash in this process
+    :param chunk_size: number of inputs hashed together, int
+    :return: generator of hashes, int
+    """
+    chunks = _chunks(inputs, chunk_size)
+    if not processes:
+        for chunk in chunks:
+            assert(0 < len(chunk[0]) < len(N_ROUNDS_P) - 1)
+            yield from _poseidon_chunk(chunk)
+        return
 
-        nstate = []
-        for i in range(0, len(state)):
-            acc = 0
-            for j in range(0, len(state)):
-                acc = add(acc, mul(M(t - 2,i,j), state[j]))
-            nstate.append(acc)
-        state = nstate
-    return state[0] % F
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for chunk in chunks:
+            assert(0 < len(chunk[0]) < len(N_ROUNDS_P) - 1)
+            pending.append(executor.submit(_poseidon_chunk, chunk))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
 
 NROUNDS = 220
 
+# The first round adds no constant
+MIMC_C = [0] + [int(c, 16) for c in mimc_constants[1:NROUNDS]]
+_MIMC_C = [_mpz(c) for c in MIMC_C]
+
 def cts(a):
-    return int(mimc_constants[a], 16)
+    return MIMC_C[a]
 
 def mimc(_xL_in, _xR_in, _k):
     xL = _xL_in
     xR = _xR_in
     k = _k
-    for i in range(0, NROUNDS):
-        c = cts(i)
-        if i==0:
-            t = add(xL, k)
-        else:
-            t = add(add(xL, k), c)
-        xR_tmp = xR
-        if i < (NROUNDS - 1):
-            xR = xL
-            xL = add(xR_tmp, pow5(t))
-        else:
-            xR = add(xR_tmp, pow5(t))
-    return [xL%F, xR%F]
+    for c in _MIMC_C[:NROUNDS - 1]:
+        xL, xR = (xR + _pow5(xL + k + c)) % _F, xL
+    xR = xR + _pow5(xL + k + _MIMC_C[NROUNDS - 1])
+    return [int(xL%_F), int(xR%_F)]
+
+def mimc_inverse(_xL_in, _xR_in, _k):
+    """Inverse of `mimc`: recover the plaintext halves from a cipher and key."""
+    res = mimc_decrypt_many([_xL_in], [_xR_in], [_k])
+    return [res[0][0], res[1][0]]
+
+def mimc_encrypt_many(xLs, xRs, ks):
+    """
+    Run `mimc` on many independent (xL, xR, k) triples in lockstep.
+
+    :return: ([xL, ...], [xR, ...])
+    """
+    xLs = list(xLs)
+    xRs = list(xRs)
+    ks = list(ks)
+    for c in _MIMC_C[:NROUNDS - 1]:
+        xLs, xRs = [(r + _pow5(l + k + c)) % _F for l, r, k in zip(xLs, xRs, ks)], xLs
+    c = _MIMC_C[NROUNDS - 1]
+    xRs = [(r + _pow5(l + k + c)) % _F for l, r, k in zip(xLs, xRs, ks)]
+    return [int(l % _F) for l in xLs], [int(r) for r in xRs]
+
+def mimc_decrypt_many(xLs, xRs, ks):
+    """
+    Invert `mimc` on many independent (xL, xR, k) triples in lockstep.
+
+    :return: ([xL, ...], [xR, ...])
+    """
+    xLs = list(xLs)
+    ks = list(ks)
+    c = _MIMC_C[NROUNDS - 1]
+    xRs = [(r - _pow5(l + k + c)) % _F for l, r, k in zip(xLs, xRs, ks)]
+    for c in reversed(_MIMC_C[:NROUNDS - 1]):
+        xLs, xRs = xRs, [(l - _pow5(r + k + c)) % _F for l, r, k in zip(xLs, xRs, ks)]
+    return [int(l) for l in xLs], [int(r) for r in xRs]
+
+MIMC_CHUNK_SIZE = 32
+
+def mimc_encrypt(data, k):
+    """
+    Encrypt a byte payload with the MiMC Feistel cipher used by the keytransfer
+    circuit.
+
+    The payload is PKCS#7 padded to a multiple of 32 bytes and every chunk is
+    split into two 128-bit halves, as in `split`. Chunk i is encrypted under key
+    k + i so that equal chunks don't produce equal ciphers; the first chunk is
+    exactly `mimc(xL, xR, k)`.
+
+    :param data: bytes
+    :param k: key, int
+    :return: list of [xL, xR] cipher pairs
+    """
+    pad_len = MIMC_CHUNK_SIZE - len(data) % MIMC_CHUNK_SIZE
+    data = data + bytes([pad_len]) * pad_len
+    chunks = [split(data[i:i + MIMC_CHUNK_SIZE]) for i in range(0, len(data), MIMC_CHUNK_SIZE)]
+    xLs, xRs = mimc_encrypt_many([c[0] for c in chunks], [c[1] for c in chunks],
+                                 [(k + i) % _F for i in range(len(chunks))])
+    return [[l, r] for l, r in zip(xLs, xRs)]
+
+def mimc_decrypt(cipher, k):
+    """
+    Decrypt the output of `mimc_encrypt`.
+
+    :param cipher: list of [xL, xR] cipher pairs
+    :param k: key, int
+    :return: bytes
+    """
+    if not cipher:
+        raise ValueError('Empty MiMC cipher')
+    xLs, xRs = mimc_decrypt_many([c[0] for c in cipher], [c[1] for c in cipher],
+                                 [(k + i) % _F for i in range(len(cipher))])
+    try:
+        data = b''.join(l.to_bytes(16, 'big') + r.to_bytes(16, 'big') for l, r in zip(xLs, xRs))
+    except OverflowError:
+        raise ValueError('Invalid MiMC cipher or key')
+    pad_len = data[-1]
+    if not 0 < pad_len <= MIMC_CHUNK_SIZE or data[-pad_len:] != bytes([pad_len]) * pad_len:
+        raise ValueError('Invalid MiMC cipher or key')
+    return data[:-pad_len]
 
 generator = [
     995203441582195749578291179787384436505546430278305826713579947235728471134,
@@ -100,102 +450,603 @@ A = 168700
 D = 168696
 
 def addPoint(a,b):
-    beta = mul(a[0],b[1])
-    gamma = mul(a[1],b[0])
-    delta = mul(sub(a[1], mul(A, a[0])), add(b[0], b[1]))
-    tau = mul(beta, gamma)
-    dtau = mul(D, tau)
-    return [div(add(beta, gamma), add(1, dtau)), div(add(delta, sub(mul(A,beta), gamma)), sub(1, dtau))]
+    beta = (a[0] * b[1]) % _F
+    gamma = (a[1] * b[0]) % _F
+    delta = (a[1] - A * a[0]) * (b[0] + b[1])
+    dtau = (D * beta * gamma) % _F
+    return [int(_div(beta + gamma, 1 + dtau)), int(_div(delta + A * beta - gamma, 1 - dtau))]
 
-def mulPointEscalar(base, e):
-    res = [0,1]
-    rem = e
-    exp = base
+# Extended twisted Edwards coordinates (X, Y, Z, T), with x = X/Z, y = Y/Z and
+# T = XY/Z. The unified addition below is complete on BabyJubJub (A is a square
+# and D is not), so scalar multiplications can run without any inversion and
+# convert back to affine once at the end. Extended points are intermediate
+# values and keep the field backend's integer type; affine results are ints.
+
+EXT_IDENTITY = (0, 1, 1, 0)
+
+def toExtended(P):
+    return (P[0] % _F, P[1] % _F, 1, (P[0] * P[1]) % _F)
+
+def fromExtended(P):
+    zinv = _invert(P[2], _F)
+    return [int((P[0] * zinv) % _F), int((P[1] * zinv) % _F)]
+
+def batchInvert(values):
+    """
+    Invert many non-zero field elements with Montgomery's trick: one inversion
+    and 3(n - 1) multiplications instead of n inversions. A zero element makes
+    every result 0, on either field backend.
+    """
+    if not values:
+        return []
+    prefix = []
+    acc = 1
+    for v in values:
+        acc = (acc * v) % _F
+        prefix.append(acc)
+    inv = _invert(acc, _F)
+    res = [0] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        res[i] = (inv * prefix[i - 1]) % _F
+        inv = (inv * values[i]) % _F
+    res[0] = inv
+    return [int(v) for v in res]
+
+def normalizePoints(points):
+    """Convert many extended points to affine with a single inversion."""
+    zinvs = batchInvert([P[2] for P in points])
+    return [[int((P[0] * zinv) % _F), int((P[1] * zinv) % _F)] for P, zinv in zip(points, zinvs)]
+
+def addPointExtended(p, q):
+    x1, y1, z1, t1 = p
+    x2, y2, z2, t2 = q
+    a = (x1 * x2) % _F
+    b = (y1 * y2) % _F
+    c = (D * t1 * t2) % _F
+    d = (z1 * z2) % _F
+    e = ((x1 + y1) * (x2 + y2) - a - b) % _F
+    f = d - c
+    g = d + c
+    h = b - A * a
+    return ((e * f) % _F, (g * h) % _F, (f * g) % _F, (e * h) % _F)
+
+def doublePointExtended(p):
+    x1, y1, z1, _ = p
+    a = (x1 * x1) % _F
+    b = (y1 * y1) % _F
+    c = (2 * z1 * z1) % _F
+    d = A * a
+    e = ((x1 + y1) * (x1 + y1) - a - b) % _F
+    g = (d + b) % _F
+    f = g - c
+    h = d - b
+    return ((e * f) % _F, (g * h) % _F, (f * g) % _F, (e * h) % _F)
 
+# Fixed-base table for base8: row i holds j * 2^(BASE8_WINDOW * i) * base8 for
+# every window digit j, so a multiplication by base8 is one addition per window.
+BASE8_WINDOW = 4
+
+@lru_cache(maxsize=None)
+def base8Table():
+    size = 1 << BASE8_WINDOW
+    table = []
+    P = toExtended(base8)
+    for _ in range(0, -(-subOrder.bit_length() // BASE8_WINDOW)):
+        row = [EXT_IDENTITY, P]
+        for _ in range(2, size):
+            row.append(addPointExtended(row[-1], P))
+        table.append(row)
+        P = doublePointExtended(row[size // 2])
+    return table
+
+def mulBase8Extended(e):
+    table = base8Table()
+    mask = (1 << BASE8_WINDOW) - 1
+    # base8 generates the subgroup of order subOrder
+    rem = e % subOrder
+    res = EXT_IDENTITY
+    i = 0
     while rem != 0:
-        if rem % 2 == 1:
-            res = addPoint(res, exp)
-        exp = addPoint(exp, exp)
-        rem = rem // 2
+        digit = rem & mask
+        if digit:
+            res = addPointExtended(res, table[i][digit])
+        rem >>= BASE8_WINDOW
+        i += 1
+    return res
+
+def mulBase8Escalar(e):
+    return fromExtended(mulBase8Extended(e))
+
+WNAF_WIDTH = 4
+
+def wnaf(e, w=WNAF_WIDTH):
+    """
+    Width-w non-adjacent form of a non-negative scalar, least significant digit first.
+
+    Every non-zero digit is odd with |digit| < 2^(w-1), and any w consecutive
+    digits contain at most one non-zero digit.
+    """
+    digits = []
+    while e > 0:
+        if e & 1:
+            d = e & ((1 << w) - 1)
+            if d >= 1 << (w - 1):
+                d -= 1 << w
+            e -= d
+        else:
+            d = 0
+        digits.append(d)
+        e >>= 1
+    return digits
+
+def negPointExtended(p):
+    return ((-p[0]) % _F, p[1], p[2], (-p[3]) % _F)
 
+def isIdentityExtended(p):
+    return p[0] % _F == 0 and (p[1] - p[2]) % _F == 0
+
+def mulPointsEscalarsExtended(points, escalars, w=WNAF_WIDTH):
+    """
+    Straus multi-scalar multiplication: sum(e_i * P_i) computed in one pass that
+    shares the doublings between all the terms, each scalar in wNAF form.
+
+    :param points: affine points
+    :param escalars: scalars, negative values allowed, int[]
+    :param w: wNAF width, int
+    :return: extended point
+    """
+    terms = []
+    for P, e in zip(points, escalars):
+        P = toExtended(P)
+        if e < 0:
+            P = negPointExtended(P)
+            e = -e
+        if e == 0:
+            continue
+        # odd multiples P, 3P, 5P, ..., (2^(w-1) - 1)P
+        odd = [P]
+        P2 = doublePointExtended(P)
+        for _ in range(1, 1 << (w - 2)):
+            odd.append(addPointExtended(odd[-1], P2))
+        terms.append((wnaf(e, w), odd, [negPointExtended(Q) for Q in odd]))
+
+    res = EXT_IDENTITY
+    for i in reversed(range(0, max((len(t[0]) for t in terms), default=0))):
+        res = doublePointExtended(res)
+        for digits, odd, neg in terms:
+            if i < len(digits):
+                d = digits[i]
+                if d > 0:
+                    res = addPointExtended(res, odd[d >> 1])
+                elif d < 0:
+                    res = addPointExtended(res, neg[(-d) >> 1])
     return res
 
+def mulPointsEscalars(points, escalars):
+    return fromExtended(mulPointsEscalarsExtended(points, escalars))
+
+def mulPointEscalar(base, e):
+    if base is base8 or base == base8:
+        return mulBase8Escalar(e)
+    return mulPointsEscalars([base], [e])
+
 def inCurve(P):
-    x2 = square(P[0])
-    y2 = square(P[1])
+    x2 = _square(P[0])
+    y2 = _square(P[1])
 
-    if add(mul(A, x2), y2) != add(1, mul(mul(x2, y2), D)):
+    if (A * x2 + y2 - 1 - D * x2 * y2) % _F != 0:
         return False
 
     return True
 
+def sqrtMod(a):
+    """Square root modulo F (Tonelli-Shanks), the one in [0, (F-1)/2], or None."""
+    a = a % _F
+    if a == 0:
+        return 0
+    if pow(a, (_F - 1) // 2, _F) != 1:
+        return None
+    # F - 1 = q * 2^s with q odd
+    q = _F - 1
+    s = 0
+    while q % 2 == 0:
+        q //= 2
+        s += 1
+    z = 5
+    while pow(z, (_F - 1) // 2, _F) != _F - 1:
+        z += 1
+    m = s
+    c = pow(z, q, _F)
+    t = pow(a, q, _F)
+    r = pow(a, (q + 1) // 2, _F)
+    while t != 1:
+        i = 1
+        t2 = (t * t) % _F
+        while t2 != 1:
+            t2 = (t2 * t2) % _F
+            i += 1
+        b = pow(c, 1 << (m - i - 1), _F)
+        m = i
+        c = (b * b) % _F
+        t = (t * c) % _F
+        r = (r * b) % _F
+    r = int(r)
+    return r if r <= (_F - 1) // 2 else int(_F - r)
+
+def packPoint(P):
+    """
+    Compress a point to 32 bytes as circomlib does: y in little-endian, with the
+    top bit set when x is in the upper half of the field.
+    """
+    buff = bytearray(int(P[1]).to_bytes(32, 'little'))
+    if P[0] > (_F - 1) // 2:
+        buff[31] |= 0x80
+    return bytes(buff)
+
+def unpackPoint(buff):
+    """Inverse of `packPoint`, None when `buff` is not a valid point encoding."""
+    if len(buff) != 32:
+        return None
+    sign = buff[31] & 0x80
+    y = int.from_bytes(bytes(buff[:31]) + bytes([buff[31] & 0x7f]), 'little')
+    if y >= _F:
+        return None
+    y2 = (y * y) % _F
+    x = sqrtMod(_div(1 - y2, A - D * y2))
+    if x is None or (sign and x == 0):
+        return None
+    if sign:
+        x = int(_F - x)
+    return [x, y]
+
+@lru_cache(maxsize=1024)
+def _parse_public_key(encoding):
+    if isinstance(encoding, tuple):
+        P = [int(v, 16) if isinstance(v, str) else int(v) for v in encoding]
+        if len(P) != 2 or not all(0 <= v < _F for v in P) or not inCurve(P):
+            raise ValueError('Invalid BabyJub public key')
+        return tuple(P)
+    if isinstance(encoding, str):
+        encoding = bytes.fromhex(encoding[2:] if encoding.startswith('0x') else encoding)
+    if len(encoding) == 32:
+        P = unpackPoint(encoding)
+        if P is None:
+            raise ValueError('Invalid BabyJub public key')
+        return tuple(P)
+    if len(encoding) == 64:
+        return _parse_public_key((int.from_bytes(encoding[:32], 'big'), int.from_bytes(encoding[32:], 'big')))
+    raise ValueError('Invalid BabyJub public key length')
+
+def parse_public_key(encoding):
+    """
+    Parse and curve-check a BabyJub public key, caching the result by encoding so
+    that repeated verifications against the same key skip the work.
+
+    :param encoding: 128 hex chars x||y as returned by `make_public`, 64 hex chars
+        or 32 bytes compressed as by `packPoint`, or an (x, y) pair of ints or
+        hex strings
+    :return: affine point, tuple
+    """
+    # normalise to hashable types for the cache
+    if isinstance(encoding, list):
+        encoding = tuple(encoding)
+    elif isinstance(encoding, (bytearray, memoryview)):
+        encoding = bytes(encoding)
+    try:
+        return _parse_public_key(encoding)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid BabyJub public key: {e}')
+
+def compress_public_key(encoding):
+    """
+    Compressed 32 byte form of a public key, hex encoded.
+
+    :param encoding: any key encoding accepted by `parse_public_key`
+    :return: hex str
+    """
+    return packPoint(parse_public_key(encoding)).hex()
+
+def checked_public_key(A):
+    # points of ints are checked here, every other encoding goes through the parsing cache
+    if isinstance(A, (list, tuple)) and len(A) == 2 and all(isinstance(v, (int, type(_F))) for v in A):
+        return A if inCurve(A) else None
+    try:
+        return parse_public_key(A)
+    except ValueError:
+        return None
+
 def make_key(provider_secret):
     c = Web3.keccak(text=provider_secret)
     return int(c.hex()[0:60], 16)
 
-def make_public(secret):
+KeyPair = namedtuple('KeyPair', ['k', 'pub'])
+
+class SecretCache:
+    """
+    Bounded, thread-safe LRU cache of values derived from secrets by `derive`.
+
+    Entries are keyed by a SHA-256 digest of the secret, so the secrets
+    themselves are not kept in memory, and optionally expire after `ttl` seconds.
+    """
+
+    def __init__(self, derive, maxsize=256, ttl=None):
+        self.derive = derive
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                return entry[1]
+        return None
+
+    def _store(self, key, now, value):
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, secret):
+        key = hashlib.sha256(secret.encode('utf-8')).digest()
+        now = time.monotonic()
+        value = self._lookup(key, now)
+        if value is None:
+            value = self.derive(secret)
+            self._store(key, now, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def derive_keypair(secret):
     k = make_key(secret)
-    buyerPub = mulPointEscalar(base8, k)
+    return KeyPair(k, mulBase8Escalar(k))
+
+class KeyPairCache(SecretCache):
+    """`SecretCache` of BabyJub key pairs."""
+
+    def __init__(self, maxsize=256, ttl=None):
+        super().__init__(derive_keypair, maxsize, ttl)
+
+    def get_many(self, secrets):
+        """
+        Batch version of `get`: the missing key pairs are derived together and
+        normalised to affine coordinates with a single field inversion.
+        """
+        now = time.monotonic()
+        keys = [hashlib.sha256(secret.encode('utf-8')).digest() for secret in secrets]
+        pairs = [self._lookup(key, now) for key in keys]
+        missing = [i for i, pair in enumerate(pairs) if pair is None]
+        ks = [make_key(secrets[i]) for i in missing]
+        pubs = normalizePoints([mulBase8Extended(k) for k in ks])
+        for i, k, pub in zip(missing, ks, pubs):
+            pairs[i] = KeyPair(k, pub)
+            self._store(keys[i], now, pairs[i])
+        return pairs
+
+key_cache = KeyPairCache()
+
+def make_keypair(secret):
+    """
+    Return the BabyJub key pair (k, pub) derived from `secret`, through `key_cache`.
+
+    :param secret: str
+    :return: KeyPair
+    """
+    return key_cache.get(secret)
+
+def make_public(secret):
+    buyerPub = make_keypair(secret).pub
     res = hex(buyerPub[0])[2:].zfill(64) + hex(buyerPub[1])[2:].zfill(64)
     return res
 
+def make_public_many(secrets):
+    """
+    Batch version of `make_public`, deriving the missing keys with one inversion.
+
+    :param secrets: list of str
+    :return: list of public keys, hex str
+    """
+    pairs = key_cache.get_many(list(secrets))
+    return [hex(pub[0])[2:].zfill(64) + hex(pub[1])[2:].zfill(64) for _, pub in pairs]
+
+class Signer:
+    """
+    EdDSA-Poseidon signer bound to one secret.
+
+    `s`, `A` and a Poseidon hasher specialised on `A` are computed once here, so
+    each signature costs one fixed-base multiplication and one Poseidon hash.
+    The nonce `r` is derived from the secret and the message, so that no two
+    messages share it. Python ints are not constant-time; this does not change that.
+    """
+
+    def __init__(self, secret):
+        self.s, self.A = make_keypair(secret)
+        self._nonce_key = hashlib.blake2b(secret.encode('utf-8'), person=b'eddsa-nonce').digest()
+        self._hash = get_poseidon_hasher(6).specialize({2: self.A[0], 3: self.A[1]})
+
+    def nonce(self, msg):
+        """
+        :param msg: message reduced mod F, int
+        :return: the deterministic nonce r for `msg`, int
+        """
+        h = hashlib.blake2b(int(msg).to_bytes(32, 'big'), key=self._nonce_key).digest()
+        return int.from_bytes(h, 'big') % subOrder
+
+    def sign(self, msg):
+        """
+        :param msg: message, int
+        :return: dict with the 'R8' point and 'S' scalar as hex str
+        """
+        msg = msg % _F
+        r = self.nonce(msg)
+        R8 = mulBase8Escalar(r)
+        hm = self._hash([R8[0], R8[1], msg])
+        return {
+            'R8': [hex(R8[0]), hex(R8[1])],
+            'S': hex((r + hm * self.s) % subOrder),
+        }
+
+signer_cache = SecretCache(Signer)
+
+def make_signer(secret):
+    """
+    Return the `Signer` for `secret`, through `signer_cache`.
+
+    :param secret: str
+    :return: Signer
+    """
+    return signer_cache.get(secret)
+
 def sign(provider_secret, msg):
-    r = make_key(provider_secret + 'a')
-    r = r % subOrder
-    s = make_key(provider_secret)
-    R8 = mulPointEscalar(base8, r)
-    A = mulPointEscalar(base8, s)
-    hm = poseidon([R8[0], R8[1], A[0], A[1], msg % F])
-    S = (r + hm*s) % subOrder
-    return {
-        'R8': [hex(R8[0]), hex(R8[1])],
-        'S': hex(S),
-    }
+    return make_signer(provider_secret).sign(msg)
 
 def verify(A, msg, sig):
     sig_R8 = [int(sig['R8'][0], 16), int(sig['R8'][1], 16)]
     sig_S = int(sig['S'], 16)
     if not inCurve(sig_R8):
         return False
-    if not inCurve(A):
+    A = checked_public_key(A)
+    if A is None:
         return False
-    if sig_S >= subOrder:
+    if not 0 <= sig_S < subOrder:
         return False
 
-    hm = poseidon([sig_R8[0], sig_R8[1], A[0], A[1], msg % F])
+    hm = poseidon([sig_R8[0], sig_R8[1], A[0], A[1], msg % _F])
 
-    Pleft = mulPointEscalar(base8, sig_S*8)
-    Pright = mulPointEscalar(A, hm*8)
-    Pright = addPoint(mulPointEscalar(sig_R8, 8), Pright)
+    # S*8*base8 == R8*8 + hm*8*A, checked as S*8*base8 - hm*8*A - 8*R8 == 0 with
+    # the fixed-base table for base8 and one interleaved pass for A and R8
+    Pleft = mulBase8Extended(sig_S*8)
+    Pright = mulPointsEscalarsExtended([A, sig_R8], [-hm*8, -8])
+    return isIdentityExtended(addPointExtended(Pleft, Pright))
 
-    if Pleft[0] != Pright[0]:
-        return False
-    if Pleft[1] != Pright[1]:
-        return False
-    return True
+def verify_batch(items):
+    """
+    Verify many signatures at once.
+
+    Each signature equation is weighted by a random 128-bit scalar z_i and the
+    sum is checked with a single multi-scalar multiplication:
+    8 * (sum(z_i*S_i)*base8 - sum(z_i*hm_i*A_i) - sum(z_i*R8_i)) == 0.
+    If the combined check fails every signature is verified on its own, so the
+    failing entries can be identified.
+
+    :param items: iterable of (public key, msg int, signature dict) tuples, the key
+        as a point or any encoding accepted by `parse_public_key`
+    :return: one bool per item, in input order
+    """
+    items = list(items)
+    results = [False] * len(items)
+    candidates = []
+    for idx, (A, msg, sig) in enumerate(items):
+        sig_R8 = [int(sig['R8'][0], 16), int(sig['R8'][1], 16)]
+        sig_S = int(sig['S'], 16)
+        if inCurve(sig_R8) and 0 <= sig_S < subOrder:
+            A = checked_public_key(A)
+            if A is not None:
+                candidates.append((idx, A, sig_R8, sig_S, msg % _F))
+    if not candidates:
+        return results
+
+    hms = get_poseidon_hasher(6).hash_many([[R8[0], R8[1], A[0], A[1], m] for _, A, R8, _, m in candidates])
+    s_sum = 0
+    points = []
+    escalars = []
+    for (_, A, sig_R8, sig_S, _), hm in zip(candidates, hms):
+        z = secrets.randbits(128) | 1
+        s_sum += z * sig_S
+        # the terms are multiplied by the cofactor, so the scalars can be reduced mod subOrder
+        points += [A, sig_R8]
+        escalars += [-8 * ((z * hm) % subOrder), -8 * z]
+    P = addPointExtended(mulBase8Extended(s_sum * 8), mulPointsEscalarsExtended(points, escalars))
+
+    if isIdentityExtended(P):
+        for idx, _, _, _, _ in candidates:
+            results[idx] = True
+    else:
+        for idx, _, _, _, _ in candidates:
+            results[idx] = verify(*items[idx])
+    return results
 
 libkey = 0
+libkey_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def cpu_has_adx():
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("flags"):
+                    return 'adx' in line.split()
+    except OSError:
+        pass
+    return False
+
+def prover_library():
+    """
+    Name or path of the native prover library: $KEYTRANSFER_LIB if set, else
+    libkeytransfer.so on CPUs with ADX and libkeytransfer_noadx.so otherwise.
+    """
+    libname = os.environ.get('KEYTRANSFER_LIB')
+    if libname:
+        return libname
+    return "libkeytransfer.so" if cpu_has_adx() else "libkeytransfer_noadx.so"
 
 def init_prover():
+    """
+    Load the native prover library once per process. Safe to call from several
+    threads, and can be called at application start so that the first proof
+    doesn't pay for loading the library.
+
+    :return: the loaded library
+    """
     global libkey
-    libname = "libkeytransfer.so"
-    file = open("/proc/cpuinfo").read()
-    if not 'adx' in file:
-        libname = "libkeytransfer_noadx.so"
-    cdll.LoadLibrary(libname)
-    libkey = CDLL(libname)
-    libkey.make.restype = c_void_p
-    libkey.fullprove.restype = c_char_p
+    with libkey_lock:
+        if libkey == 0:
+            lib = CDLL(prover_library())
+            lib.make.restype = c_void_p
+            lib.fullprove.restype = c_char_p
+            libkey = lib
+    return libkey
 
 def make_prover(zkey, dat):
     if libkey == 0:
         init_prover()
     return libkey.make(zkey.encode('utf-8'), dat.encode('utf-8'))
 
+def proof_tmp_dir():
+    """
+    Directory for the per-proof witness files: $KEYTRANSFER_TMPDIR if set, else
+    /dev/shm when available so that the files stay in memory, else the default
+    temporary directory.
+    """
+    path = os.environ.get('KEYTRANSFER_TMPDIR')
+    if path:
+        return path
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
 def prove(prover, input):
-    with open('/tmp/input.json', 'w') as outfile:
-        json.dump(input, outfile)
-    res = libkey.fullprove(c_void_p(prover), b"/tmp/keytransfer.wtns", b"/tmp/input.json")
+    # a ProverPool queues the proof on one of its own prover instances
+    if hasattr(prover, 'submit'):
+        return prover.prove(input)
+    # libkeytransfer reads the input and writes the witness through file paths, so
+    # every call gets its own directory and concurrent proofs don't clobber each other
+    with tempfile.TemporaryDirectory(prefix='keytransfer-', dir=proof_tmp_dir()) as tmp:
+        input_path = os.path.join(tmp, 'input.json')
+        wtns_path = os.path.join(tmp, 'keytransfer.wtns')
+        with open(input_path, 'w') as outfile:
+            json.dump(input, outfile)
+        res = libkey.fullprove(c_void_p(prover), wtns_path.encode('utf-8'), input_path.encode('utf-8'))
     return res.decode()
 
 def split(data):
@@ -205,16 +1056,48 @@ def hash_key(data):
     lst = split(data)
     return hex(poseidon(lst))
 
+def hash_keys(datas, processes=None, chunk_size=256):
+    """
+    Batch version of `hash_key`, yielding the hashes in input order.
+
+    :param datas: iterable of 32 byte keys
+    :param processes: number of worker processes, None to hash in this process
+    :param chunk_size: number of keys hashed together, int
+    :return: generator of hashes, hex str
+    """
+    for h in poseidon_many((split(data) for data in datas), processes, chunk_size):
+        yield hex(h)
+
 def hx(a):
     return str(a)
 
-def prove_transfer(prover, buyerPub, providerK, data):
+@lru_cache(maxsize=256)
+def provider_public(providerK):
+    """
+    Provider public key for the scalar `providerK`, cached across sales.
+
+    :param providerK: provider secret scalar, int
+    :return: affine point, tuple
+    """
+    return tuple(mulBase8Escalar(providerK))
+
+def prepare_transfer(buyerPub, providerK, data):
+    """
+    Compute everything needed for a key transfer except the proof: the cipher of
+    `data` under the shared secret, the Poseidon hash of `data` and the SNARK
+    inputs for `finish_proof`.
+
+    :param buyerPub: buyer public key, affine point
+    :param providerK: provider secret scalar, int
+    :param data: 32 byte key
+    :return: dict with 'hash', 'cipher' and 'snark_params'
+    """
     orig = split(data)
 
     k = mulPointEscalar(buyerPub, providerK)
     cipher = mimc(orig[0], orig[1], k[0])
     origHash = poseidon([orig[0], orig[1]])
-    providerPub = mulPointEscalar(base8, providerK)
+    providerPub = provider_public(providerK)
 
 
     snarkParams = {
@@ -230,10 +1113,39 @@ def prove_transfer(prover, buyerPub, providerK, data):
         'hash_plain': hx(origHash)
     }
 
+    return {
+        'hash': hex(origHash),
+        'cipher': [hex(cipher[0]), hex(cipher[1])],
+        'snark_params': snarkParams,
+    }
+
+proof_executor = None
+proof_executor_lock = threading.Lock()
+
+def finish_proof(prover, prepared):
+    """
+    Start the proof for a transfer returned by `prepare_transfer`.
+
+    With a `ProverPool` the proof is queued on the pool; a single prover handle
+    runs its proofs one at a time on a background thread.
+
+    :param prover: prover handle from `make_prover`, or a ProverPool
+    :param prepared: dict returned by `prepare_transfer`
+    :return: concurrent.futures.Future resolving to the proof, str
+    """
+    global proof_executor
+    if hasattr(prover, 'submit'):
+        return prover.submit(prepared['snark_params'])
+    with proof_executor_lock:
+        if proof_executor is None:
+            proof_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='keytransfer-proof')
+    return proof_executor.submit(prove, prover, prepared['snark_params'])
+
+def prove_transfer(prover, buyerPub, providerK, data):
+    prepared = prepare_transfer(buyerPub, providerK, data)
     res = {
-        'proof': prove(prover, snarkParams),
-        'hash': hash_key(data),
-        'cipher': [hex(cipher[0]), hex(cipher[1])]
+        'proof': prove(prover, prepared['snark_params']),
+        'hash': prepared['hash'],
+        'cipher': prepared['cipher']
     }
     return res
-
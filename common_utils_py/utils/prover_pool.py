@@ -0,0 +1,118 @@
+"""Pool of native keytransfer provers for concurrent zk key-transfer proofs."""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common_utils_py.utils import keytransfer
+
+
+class ProverPool:
+    """
+    Keeps `size` libkeytransfer prover instances created from one zkey/dat pair
+    and runs proofs on a matching number of worker threads.
+
+    ctypes releases the GIL for the duration of the native `fullprove` call, so
+    the proofs run in parallel while the Python side only hands out inputs.
+
+    Every instance loads its own copy of the zkey and the native prover is
+    already multithreaded, so `size` defaults to 1; raise it only when there is
+    memory for that many zkey copies.
+    """
+
+    def __init__(self, zkey, dat, size=1):
+        self.zkey = zkey
+        self.dat = dat
+        self.size = size
+        self._provers = queue.Queue()
+        for _ in range(self.size):
+            self._provers.put(keytransfer.make_prover(zkey, dat))
+        self._executor = ThreadPoolExecutor(max_workers=self.size,
+                                            thread_name_prefix='keytransfer-prover')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _run(self, input, submitted):
+        prover = self._provers.get()
+        started = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_total += started - submitted
+        failed = True
+        try:
+            res = keytransfer.prove(prover, input)
+            failed = False
+            return res
+        finally:
+            self._provers.put(prover)
+            latency = time.monotonic() - submitted
+            with self._lock:
+                self._running -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+
+    def submit(self, input):
+        """
+        Queue a proof for the given SNARK input.
+
+        :param input: SNARK input parameters, dict
+        :return: concurrent.futures.Future resolving to the proof, str
+        """
+        with self._lock:
+            self._queued += 1
+        try:
+            return self._executor.submit(self._run, input, time.monotonic())
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            raise
+
+    def prove(self, input):
+        """Blocking version of `submit`."""
+        return self.submit(input).result()
+
+    async def prove_async(self, input):
+        """`asyncio` version of `submit`."""
+        return await asyncio.wrap_future(self.submit(input))
+
+    def metrics(self):
+        """
+        Return the pool metrics.
+
+        :return: dict with the queue depth, the number of running, completed and
+            failed proofs, and the average wait and end-to-end latency in seconds
+        """
+        with self._lock:
+            done = self._completed + self._failed
+            started = done + self._running
+            return {
+                'size': self.size,
+                'queue_depth': self._queued,
+                'running': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'wait_avg': self._wait_total / started if started else 0.0,
+                'latency_avg': self._latency_total / done if done else 0.0,
+                'latency_max': self._latency_max,
+            }
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
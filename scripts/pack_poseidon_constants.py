@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""Pack circomlib's Poseidon constants JSON ({"C": [...], "M": [...]}) into the
+binary table read by `common_utils_py.utils.poseidon_constants`.
+
+Usage: python scripts/pack_poseidon_constants.py poseidon_constants.json [output.bin]
+"""
+import json
+import os
+import struct
+import sys
+
+MAGIC = b'PSDN'
+VERSION = 1
+HEADER = struct.Struct('>4sHH')
+ENTRY = struct.Struct('>HII')
+ELEMENT_SIZE = 32
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), '..', 'common_utils_py', 'utils',
+                              'poseidon_constants.bin')
+
+
+def pack(constants):
+    widths = len(constants['C'])
+    offset = HEADER.size + ENTRY.size * widths
+    entries = []
+    body = []
+    for a in range(widths):
+        t = a + 2
+        C = constants['C'][a]
+        M = constants['M'][a]
+        assert len(M) == t and all(len(row) == t for row in M)
+        entries.append(ENTRY.pack(t, offset, len(C)))
+        for value in C + [m for row in M for m in row]:
+            body.append(int(value, 16).to_bytes(ELEMENT_SIZE, 'big'))
+        offset += ELEMENT_SIZE * (len(C) + t * t)
+    return HEADER.pack(MAGIC, VERSION, widths) + b''.join(entries) + b''.join(body)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    with open(sys.argv[1]) as f:
+        data = pack(json.load(f))
+    output = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_OUTPUT
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f'wrote {len(data)} bytes to {output}')
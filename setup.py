@@ -47,6 +47,11 @@ dev_requirements = [
     'watchdog',
 ]
 
+# Optional faster big-integer arithmetic for keytransfer
+gmpy_requirements = [
+    'gmpy2',
+]
+
 docs_requirements = [
     'Sphinx',
     'sphinxcontrib-apidoc',
@@ -72,6 +77,7 @@ setup(
         'test': test_requirements,
         'dev': dev_requirements + test_requirements + docs_requirements,
         'docs': docs_requirements,
+        'gmpy': gmpy_requirements,
     },
     install_requires=install_requirements,
     license="Apache Software License 2.0",
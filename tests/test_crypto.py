@@ -1,8 +1,24 @@
+import base64
+import io
+import os
+import shutil
+from collections import namedtuple
+
+import pytest
 from ecies import encrypt, decrypt
 from ecies.utils import generate_eth_key
+from contracts_lib_py.utils import add_ethereum_prefix_and_hash_msg
+from contracts_lib_py.wallet import Wallet
+from web3.auto import w3
 
+from common_utils_py.oauth2.jwk_utils import key_file_to_jwk
+from common_utils_py.utils import crypto
 from common_utils_py.utils.crypto import decryption, encryption, get_keys_from_file, get_rsa_public_key_from_file, \
-    get_rsa_private_key_from_file, rsa_encryption, rsa_decryption, aes_encryption, aes_decryption
+    get_rsa_private_key_from_file, rsa_encryption, rsa_decryption, aes_encryption, aes_decryption, \
+    ecdsa_decryption, ecdsa_encryption_from_file, get_key_material, keystore_cache, get_message_signer, \
+    sign_message, warm_message_signers, AESCipher, derive_aes_private_key, get_aes_private_key, \
+    aes_encryption_stream, aes_decryption_stream, rsa_encryption_stream, rsa_decryption_stream, \
+    get_content_keyfile_from_path, key_file_cache, rsa_decryption_aes, rsa_encryption_from_file
 
 PROVIDER_KEY_FILE = 'tests/resources/data/publisher_key_file.json'
 PROVIDER_PASSWORD = 'node0'
@@ -10,6 +26,8 @@ PROVIDER_ADDRESS = '0x00bd138abd70e2f00903268f3db08f2d25677c9e'
 RSA_PRIVKEY_FILE = 'tests/resources/data/rsa_priv_key.pem'
 RSA_PUBKEY_FILE = 'tests/resources/data/rsa_pub_key.pem'
 
+Account = namedtuple('Account', ['key_file', 'password', 'address'])
+
 
 def test_encryption_decryption():
     eth_k = generate_eth_key()
@@ -69,3 +87,122 @@ def test_aes_encryption_decryption():
     assert data == aes_decryption(encrypted_data, passphrase)
 
 
+def test_keystore_cache(tmp_path):
+    keyfile_path = str(tmp_path / 'key_file.json')
+    shutil.copy(PROVIDER_KEY_FILE, keyfile_path)
+
+    material = get_key_material(keyfile_path, PROVIDER_PASSWORD)
+    assert get_key_material(keyfile_path, PROVIDER_PASSWORD) is material
+    assert get_key_material(material) is material
+    assert (material.public_key_hex, material.private_key_hex) == get_keys_from_file(keyfile_path, PROVIDER_PASSWORD)
+
+    stat = os.stat(keyfile_path)
+    os.utime(keyfile_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    reloaded = get_key_material(keyfile_path, PROVIDER_PASSWORD)
+    assert reloaded is not material
+    assert reloaded.private_key == material.private_key
+
+    keystore_cache.invalidate(keyfile_path)
+    assert get_key_material(keyfile_path, PROVIDER_PASSWORD) is not reloaded
+
+
+def test_ecdsa_with_key_material():
+    material = get_key_material(PROVIDER_KEY_FILE, PROVIDER_PASSWORD)
+    encrypted, public_key_hex = ecdsa_encryption_from_file('hi there', material)
+    assert public_key_hex == material.public_key_hex
+    assert ecdsa_decryption(encrypted, material) == 'hi there'
+    assert ecdsa_decryption(encrypted, PROVIDER_KEY_FILE, PROVIDER_PASSWORD) == 'hi there'
+    assert decryption(material, encryption(material, b'hi there')) == b'hi there'
+    assert key_file_to_jwk(material) == key_file_to_jwk(PROVIDER_KEY_FILE, PROVIDER_PASSWORD)
+
+    with pytest.raises(ValueError):
+        ecdsa_decryption(encrypted, PROVIDER_KEY_FILE)
+    with pytest.raises(ValueError):
+        key_file_to_jwk(PROVIDER_KEY_FILE)
+
+
+def test_sign_message():
+    account = Account(PROVIDER_KEY_FILE, PROVIDER_PASSWORD, PROVIDER_ADDRESS)
+    warm_message_signers([account])
+    signer = get_message_signer(account)
+    assert get_message_signer(account) is signer
+    assert signer.address.lower() == PROVIDER_ADDRESS
+
+    wallet = Wallet(w3, account.key_file, account.password, account.address)
+    for message in ['hi there', '']:
+        expected = wallet.sign(add_ethereum_prefix_and_hash_msg(message)).signature
+        assert sign_message(message, account) == expected
+
+
+def test_aes_cipher():
+    passphrase = 'my passphrase'
+    cipher = AESCipher(passphrase)
+    assert cipher.key == derive_aes_private_key(passphrase)
+    assert get_aes_private_key(passphrase) is get_aes_private_key(passphrase)
+    assert get_aes_private_key(passphrase.encode()) == cipher.key
+
+    urls = [b'https://example.com/file%d.csv' % i for i in range(8)]
+    encrypted = [cipher.encrypt(url) for url in urls]
+    assert [aes_decryption(data, passphrase) for data in encrypted] == urls
+    assert cipher.decrypt(aes_encryption(urls[0], passphrase)) == urls[0]
+
+    # RSA session keys are single use and stay out of the cache
+    cached = len(crypto._aes_keys)
+    encrypted_data, encrypted_aes_key = rsa_encryption(get_rsa_public_key_from_file(RSA_PUBKEY_FILE), urls[0])
+    assert rsa_decryption(get_rsa_private_key_from_file(RSA_PRIVKEY_FILE), encrypted_data, encrypted_aes_key) == urls[0]
+    assert len(crypto._aes_keys) == cached
+
+
+def test_aes_encryption_binary_data():
+    data = os.urandom(100) + 'héllo'.encode()
+    assert aes_decryption(aes_encryption(data, 'my passphrase'), 'my passphrase') == data
+
+
+def test_aes_stream():
+    passphrase = 'my passphrase'
+    data = os.urandom(100000)
+    encrypted = b''.join(aes_encryption_stream(io.BytesIO(data), passphrase, chunk_size=1000))
+    assert aes_decryption(base64.b64encode(encrypted), passphrase) == data
+
+    chunks = [encrypted[i:i + 777] for i in range(0, len(encrypted), 777)]
+    assert b''.join(aes_decryption_stream(chunks, passphrase)) == data
+    assert b''.join(aes_decryption_stream([base64.b64decode(aes_encryption(b'', passphrase))], passphrase)) == b''
+
+    with pytest.raises(ValueError):
+        list(aes_decryption_stream([encrypted[:-1]], passphrase))
+
+
+def test_rsa_stream():
+    pub_key = get_rsa_public_key_from_file(RSA_PUBKEY_FILE)
+    priv_key = get_rsa_private_key_from_file(RSA_PRIVKEY_FILE)
+
+    data = [os.urandom(5000) for _ in range(10)]
+    encrypted_chunks, encrypted_aes_key = rsa_encryption_stream(pub_key, iter(data))
+    encrypted = b''.join(encrypted_chunks)
+    decrypted = rsa_decryption_stream(priv_key, io.BytesIO(encrypted), encrypted_aes_key, chunk_size=4096)
+    assert b''.join(decrypted) == b''.join(data)
+
+
+def test_rsa_key_file_cache(tmp_path):
+    pub_key_file = str(tmp_path / 'rsa_pub_key.pem')
+    shutil.copy(RSA_PUBKEY_FILE, pub_key_file)
+
+    pub_key = get_rsa_public_key_from_file(pub_key_file)
+    assert get_rsa_public_key_from_file(pub_key_file) is pub_key
+    assert get_rsa_private_key_from_file(RSA_PRIVKEY_FILE) is get_rsa_private_key_from_file(RSA_PRIVKEY_FILE)
+    with open(pub_key_file) as keyfile:
+        assert '-----' not in get_content_keyfile_from_path(pub_key_file)
+        assert get_content_keyfile_from_path(pub_key_file) in keyfile.read().replace('\n', '')
+
+    encrypted, pub_key_body = rsa_encryption_from_file('hi there', pub_key_file)
+    assert pub_key_body == get_content_keyfile_from_path(pub_key_file)
+    assert rsa_decryption_aes(encrypted, RSA_PRIVKEY_FILE) == b'hi there'
+
+    stat = os.stat(pub_key_file)
+    os.utime(pub_key_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    reloaded = get_rsa_public_key_from_file(pub_key_file)
+    assert reloaded is not pub_key
+    assert reloaded == pub_key
+
+    key_file_cache.invalidate(pub_key_file)
+    assert get_rsa_public_key_from_file(pub_key_file) is not reloaded
@@ -1,6 +1,14 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
-from common_utils_py.utils import keytransfer
+from common_utils_py.utils import field_backend, keytransfer, poseidon_constants
 
 
 def test_poseidon():
@@ -34,3 +42,319 @@ def test_signature():
     sig = keytransfer.sign(buyer_secret, dta_num)
     assert keytransfer.verify(buyer_pub, dta_num, sig)
 
+
+def test_poseidon_hasher():
+    hasher = keytransfer.get_poseidon_hasher(3)
+    assert hasher is keytransfer.get_poseidon_hasher(3)
+    assert hasher.hash([1, 2]) == keytransfer.poseidon([1, 2])
+    assert keytransfer.C(1, 0) == poseidon_constants.load(3)[0][0]
+
+
+def test_poseidon_constants_table():
+    # SHA-256 of every constant of the original hex tables as 32-byte big-endian
+    # values, width by width: round constants, then the MDS matrix row by row
+    digest = hashlib.sha256()
+    assert poseidon_constants.widths() == list(range(2, 18))
+    for t in poseidon_constants.widths():
+        C, M = poseidon_constants.load(t)
+        for v in C + [m for row in M for m in row]:
+            digest.update(v.to_bytes(32, 'big'))
+    assert digest.hexdigest() == '5243c148ce09f35ab26d165cebb81c7effd00e89f3c0ae46df35177bebee4135'
+
+    legacy = poseidon_constants.constants
+    assert poseidon_constants.constants is legacy
+    C, M = poseidon_constants.load(6)
+    assert [int(c, 16) for c in legacy['C'][4]] == C
+    assert [[int(m, 16) for m in row] for row in legacy['M'][4]] == M
+
+@pytest.mark.parametrize('inputs, expected', [
+    ([1], 0x29176100eaa962bdc1fe6c654d6a3c130e96a4d1168b33848b897dc502820133),
+    ([1, 2], 0x115cc0f5e7d690413df64c6b9662e9cf2a3617f2743245519e19607a4417189a),
+    ([1, 2, 3, 4, 5], 0xdab9449e4a1398a15224c0b15a49d598b2174d305a316c918125f8feeb123c0),
+    ([1, 2, 3, 4, 5, 6, 7, 8], 0x2921ab9bd0140cbc98e40395c0fefb40337a4d54fbbecd9a4d43b3d8d0c4d8d1),
+    (list(range(1, 15)), 0x1278779aaafc5ca58bf573151005830cdb4683fb26591c85a7464d4f0e527776),
+])
+def test_poseidon_known_answers(inputs, expected):
+    assert keytransfer.poseidon(inputs) == expected
+
+def test_poseidon_many():
+    inputs = [[i, i + 1, i * 7] for i in range(10)]
+    expected = [keytransfer.poseidon(x) for x in inputs]
+    assert list(keytransfer.poseidon_many(inputs, chunk_size=4)) == expected
+    assert list(keytransfer.poseidon_many(iter(inputs), processes=2, chunk_size=3)) == expected
+
+def test_hash_keys():
+    datas = [bytes([i]) * 32 for i in range(5)]
+    assert list(keytransfer.hash_keys(datas)) == [keytransfer.hash_key(data) for data in datas]
+
+@pytest.mark.parametrize('t', poseidon_constants.widths())
+def test_poseidon_optimized_matches_reference(t):
+    hasher = keytransfer.get_poseidon_hasher(t)
+    batch = [list(range(1, t)), [keytransfer.F - i for i in range(1, t)], [0] * (t - 1)]
+    expected = [hasher.hash_reference(inputs) for inputs in batch]
+    assert [hasher.hash(inputs) for inputs in batch] == expected
+    assert hasher.hash_many(batch) == expected
+    inputs = batch[1]
+    assert hasher.specialize(dict(enumerate(inputs[:-1])))(inputs[-1:]) == expected[1]
+    assert hasher.specialize({0: inputs[0]})(inputs[1:]) == expected[1]
+    assert hasher.specialize({})(inputs) == expected[1]
+
+def test_extended_coordinates():
+    p = keytransfer.mulPointEscalar(keytransfer.base8, 5)
+    q = keytransfer.mulPointEscalar(keytransfer.base8, 7)
+    p_ext = keytransfer.toExtended(p)
+    q_ext = keytransfer.toExtended(q)
+    assert keytransfer.fromExtended(keytransfer.addPointExtended(p_ext, q_ext)) == keytransfer.addPoint(p, q)
+    assert keytransfer.fromExtended(keytransfer.doublePointExtended(p_ext)) == keytransfer.addPoint(p, p)
+    assert keytransfer.mulPointEscalar(keytransfer.base8, 0) == [0, 1]
+    assert keytransfer.mulPointEscalar(keytransfer.base8, keytransfer.subOrder) == [0, 1]
+
+def test_mul_base8():
+    for k in [0, 1, 15, 16, 123456789, keytransfer.subOrder - 1, keytransfer.subOrder + 3, 2 ** 256 - 1]:
+        # a tuple does not compare equal to base8, so this takes the generic wNAF path
+        # instead of the fixed-base table
+        expected = keytransfer.mulPointEscalar(tuple(keytransfer.base8), k)
+        assert keytransfer.mulBase8Escalar(k) == expected
+
+def test_wnaf():
+    for e in [1, 7, 8, 255, 2 ** 128 + 5, keytransfer.subOrder - 1]:
+        digits = keytransfer.wnaf(e)
+        assert sum(d << i for i, d in enumerate(digits)) == e
+        assert all(d % 2 == 1 and abs(d) < 8 for d in digits if d)
+
+def test_mul_points_escalars():
+    p = keytransfer.mulPointEscalar(keytransfer.base8, 123)
+    q = keytransfer.mulPointEscalar(keytransfer.generator, 456)
+    expected = keytransfer.addPoint(keytransfer.mulPointEscalar(p, 2 ** 200 + 77),
+                                    keytransfer.mulPointEscalar(q, 3 ** 100))
+    assert keytransfer.mulPointsEscalars([p, q], [2 ** 200 + 77, 3 ** 100]) == expected
+    assert keytransfer.mulPointsEscalars([p, p], [5, -5]) == [0, 1]
+
+def test_verify_rejects_wrong_message():
+    sig = keytransfer.sign("abc123", 42)
+    buyer_pub = keytransfer.mulPointEscalar(keytransfer.base8, keytransfer.make_key("abc123"))
+    assert keytransfer.verify(buyer_pub, 42, sig)
+    assert not keytransfer.verify(buyer_pub, 43, sig)
+
+def test_verify_rejects_out_of_range_s():
+    sig = keytransfer.sign("abc123", 42)
+    buyer_pub = keytransfer.make_keypair("abc123").pub
+    S = int(sig['S'], 16)
+    assert not keytransfer.verify(buyer_pub, 42, dict(sig, S=hex(S - keytransfer.subOrder)))
+    assert not keytransfer.verify(buyer_pub, 42, dict(sig, S=hex(S + keytransfer.subOrder)))
+
+def test_verify_batch():
+    items = []
+    for i in range(4):
+        secret = "secret%d" % i
+        pub = keytransfer.mulPointEscalar(keytransfer.base8, keytransfer.make_key(secret))
+        items.append((pub, 1000 + i, keytransfer.sign(secret, 1000 + i)))
+    assert keytransfer.verify_batch(items) == [True] * 4
+
+    items[2] = (items[2][0], 7, items[2][2])
+    assert keytransfer.verify_batch(items) == [True, True, False, True]
+    assert keytransfer.verify_batch([]) == []
+
+    pub, msg, sig = items[0]
+    negative = dict(sig, S=hex(int(sig['S'], 16) - keytransfer.subOrder))
+    assert keytransfer.verify_batch([(pub, msg, negative)]) == [False]
+    assert keytransfer.verify_batch([(pub, msg, negative), items[1]]) == [False, True]
+
+def test_key_pair_cache():
+    cache = keytransfer.KeyPairCache(maxsize=2)
+    pair = cache.get("abc123")
+    assert pair.k == keytransfer.make_key("abc123")
+    assert pair.pub == keytransfer.mulPointEscalar(keytransfer.base8, pair.k)
+    assert cache.get("abc123") is pair
+    cache.get("other1")
+    cache.get("other2")
+    assert len(cache) == 2
+    assert cache.get("abc123") is not pair
+
+    expired = keytransfer.KeyPairCache(ttl=0)
+    assert expired.get("abc123") is not expired.get("abc123")
+
+    pub = keytransfer.make_public("abc123")
+    assert pub == '%064x%064x' % tuple(keytransfer.mulPointEscalar(keytransfer.base8, pair.k))
+
+def test_prover_library(monkeypatch):
+    assert keytransfer.cpu_has_adx() is keytransfer.cpu_has_adx()
+    monkeypatch.setenv('KEYTRANSFER_LIB', '/opt/keytransfer/libkeytransfer.so')
+    assert keytransfer.prover_library() == '/opt/keytransfer/libkeytransfer.so'
+    monkeypatch.delenv('KEYTRANSFER_LIB')
+    assert keytransfer.prover_library() in ('libkeytransfer.so', 'libkeytransfer_noadx.so')
+
+def test_prove_tmp_dirs(monkeypatch, tmp_path):
+    barrier = threading.Barrier(2)
+    paths = []
+
+    class FakeLib:
+        def fullprove(self, prover, wtns_path, input_path):
+            with open(input_path) as f:
+                n = json.load(f)['n']
+            paths.append(os.path.dirname(input_path.decode()))
+            barrier.wait(timeout=5)
+            return b'proof-%d' % n
+
+    monkeypatch.setattr(keytransfer, 'libkey', FakeLib())
+    monkeypatch.setenv('KEYTRANSFER_TMPDIR', str(tmp_path))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda n: keytransfer.prove(1, {'n': n}), range(2)))
+    assert results == ['proof-0', 'proof-1']
+    assert len(set(paths)) == 2
+    assert all(os.path.dirname(path) == str(tmp_path) for path in paths)
+    assert not any(os.path.exists(path) for path in paths)
+
+def test_prepare_transfer():
+    data = b"123456789q01234567890q1234567890"
+    buyer_k = 123
+    provider_k = 234
+    buyer_pub = keytransfer.mulPointEscalar(keytransfer.base8, buyer_k)
+    prepared = keytransfer.prepare_transfer(buyer_pub, provider_k, data)
+    assert prepared['hash'] == keytransfer.hash_key(data)
+
+    provider_pub = keytransfer.provider_public(provider_k)
+    assert provider_pub is keytransfer.provider_public(provider_k)
+    assert prepared['snark_params']['provider_x'] == str(provider_pub[0])
+
+    shared = keytransfer.mulPointEscalar(list(provider_pub), buyer_k)
+    orig = keytransfer.split(data)
+    assert prepared['cipher'] == [hex(c) for c in keytransfer.mimc(orig[0], orig[1], shared[0])]
+
+def test_mimc_inverse():
+    k = 8496618697356220059886051648941066104102428018438044414794308085967084497473
+    assert keytransfer.mimc_inverse(*keytransfer.mimc(1, 2, k), k) == [1, 2]
+
+def test_mimc_encrypt_decrypt():
+    k = 8496618697356220059886051648941066104102428018438044414794308085967084497473
+    data = b"123456789q01234567890q1234567890"
+    cipher = keytransfer.mimc_encrypt(data, k)
+    assert len(cipher) == 2
+    assert cipher[0] == keytransfer.mimc(*keytransfer.split(data), k)
+    assert keytransfer.mimc_decrypt(cipher, k) == data
+
+    payload = bytes(range(256)) * 3
+    cipher = keytransfer.mimc_encrypt(payload, k)
+    assert cipher[0] != cipher[8]
+    assert keytransfer.mimc_decrypt(cipher, k) == payload
+    assert keytransfer.mimc_decrypt(keytransfer.mimc_encrypt(b"", k), k) == b""
+    with pytest.raises(ValueError):
+        keytransfer.mimc_decrypt(cipher, k + 1)
+
+def test_field_backend_results_are_ints():
+    assert field_backend.NAME in ('python', 'gmpy2')
+    assert type(keytransfer.poseidon([1, 2])) is int
+    assert all(type(v) is int for v in keytransfer.mimc(1, 2, 3))
+    assert all(type(v) is int for v in keytransfer.mulPointEscalar(keytransfer.base8, 5))
+    assert all(type(v) is int for v in keytransfer.addPoint(keytransfer.base8, keytransfer.base8))
+
+FIELD_BACKEND_CHECK = """
+import json
+from common_utils_py.utils import field_backend, keytransfer as kt
+P = kt.mulPointEscalar(kt.base8, 5)
+print(json.dumps({
+    'backend': field_backend.NAME,
+    'F': kt.F,
+    'helpers': [kt.add(3, 4), kt.sub(3, 4), kt.mul(2, 3), kt.square(7), kt.pow5(3), kt.div(5, 3),
+                kt.dot([1, 2], [3, 4]), kt.C(1, 0), kt.M(1, 0, 0), kt.cts(3)],
+    'zero': [kt.div(5, 0), kt.batchInvert([3, 0]), kt.fromExtended((1, 1, 0, 1))],
+    'points': [P, kt.batchInvert([3, 5]), kt.unpackPoint(kt.packPoint(P)), kt.sqrtMod(4)],
+    'hashes': [kt.poseidon([1, 2]), kt.mimc(1, 2, 3), kt.sign('abc123', 42)],
+}))
+"""
+
+@pytest.mark.parametrize('backend', ['python', 'gmpy2'])
+def test_field_backends_agree(backend):
+    # each backend is selected at import, so it runs in its own interpreter;
+    # json.dumps fails on anything that is not a plain int
+    if backend == 'gmpy2':
+        pytest.importorskip('gmpy2')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, KEYTRANSFER_FIELD_BACKEND=backend, PYTHONPATH=root)
+    out = subprocess.run([sys.executable, '-c', FIELD_BACKEND_CHECK], env=env, cwd=root,
+                         check=True, capture_output=True, text=True).stdout
+    results = json.loads(out)
+    assert results.pop('backend') == backend
+    assert results['zero'] == [0, [0, 0], [0, 0]]
+    P = keytransfer.mulPointEscalar(keytransfer.base8, 5)
+    assert results['points'][0] == P
+    assert results['hashes'][0] == keytransfer.poseidon([1, 2])
+    assert results['hashes'][2] == keytransfer.sign('abc123', 42)
+    assert results['helpers'][5] == keytransfer.div(5, 3)
+
+def test_batch_invert():
+    values = [1, 2, 3, keytransfer.F - 1, 123456789]
+    assert keytransfer.batchInvert(values) == [pow(v, keytransfer.F - 2, keytransfer.F) for v in values]
+    assert keytransfer.batchInvert([]) == []
+    points = [keytransfer.doublePointExtended(keytransfer.toExtended(keytransfer.mulPointEscalar(keytransfer.base8, k)))
+              for k in [1, 2, 3]]
+    assert keytransfer.normalizePoints(points) == [keytransfer.fromExtended(p) for p in points]
+
+def test_make_public_many():
+    secrets = ["abc123", "secret1", "secret2", "abc123"]
+    keytransfer.key_cache.clear()
+    keytransfer.make_public("secret1")
+    assert keytransfer.make_public_many(secrets) == [keytransfer.make_public(s) for s in secrets]
+
+def test_sqrt_mod():
+    for v in [0, 1, 4, 123456789, keytransfer.F - 1]:
+        r = keytransfer.sqrtMod(v * v % keytransfer.F)
+        assert r * r % keytransfer.F == v * v % keytransfer.F
+        assert r <= (keytransfer.F - 1) // 2
+    assert keytransfer.sqrtMod(5) is None
+
+def test_pack_point():
+    for k in [1, 2, 123, 2 ** 200 + 1]:
+        p = keytransfer.mulPointEscalar(keytransfer.base8, k)
+        packed = keytransfer.packPoint(p)
+        assert len(packed) == 32
+        assert keytransfer.unpackPoint(packed) == p
+    assert keytransfer.unpackPoint(b"\xff" * 32) is None
+
+def test_parse_public_key():
+    pub_hex = keytransfer.make_public("abc123")
+    point = keytransfer.parse_public_key(pub_hex)
+    assert list(point) == keytransfer.make_keypair("abc123").pub
+    assert keytransfer.parse_public_key(pub_hex) is point
+    compressed = keytransfer.compress_public_key(pub_hex)
+    assert len(compressed) == 64
+    assert keytransfer.parse_public_key(compressed) == point
+    packed = bytes.fromhex(compressed)
+    assert keytransfer.parse_public_key(bytearray(packed)) == point
+    assert keytransfer.parse_public_key(memoryview(packed)) == point
+    assert keytransfer.parse_public_key(['0x' + pub_hex[:64], '0x' + pub_hex[64:]]) == point
+    with pytest.raises(ValueError):
+        keytransfer.parse_public_key('00' * 64)
+
+    sig = keytransfer.sign("abc123", 42)
+    assert keytransfer.verify(pub_hex, 42, sig)
+    assert keytransfer.verify(compressed, 42, sig)
+    assert keytransfer.verify(bytearray(packed), 42, sig)
+    assert not keytransfer.verify('00' * 64, 42, sig)
+    assert keytransfer.verify_batch([(compressed, 42, sig), (pub_hex, 43, sig)]) == [True, False]
+    hex_pair = ['0x' + pub_hex[:64], '0x' + pub_hex[64:]]
+    assert keytransfer.verify(hex_pair, 42, sig)
+    assert keytransfer.verify(tuple(hex_pair), 42, sig)
+    assert keytransfer.verify_batch([(hex_pair, 42, sig), (tuple(hex_pair), 43, sig)]) == [True, False]
+    assert not keytransfer.verify(['0x0', '0x0'], 42, sig)
+
+def test_signer():
+    signer = keytransfer.make_signer("abc123")
+    assert signer is keytransfer.make_signer("abc123")
+    assert signer.A == keytransfer.make_keypair("abc123").pub
+    msg = keytransfer.F + 42
+    r = signer.nonce(42)
+    R8 = keytransfer.mulPointEscalar(keytransfer.base8, r)
+    hm = keytransfer.poseidon([R8[0], R8[1], signer.A[0], signer.A[1], 42])
+    assert signer.sign(msg) == {
+        'R8': [hex(R8[0]), hex(R8[1])],
+        'S': hex((r + hm * signer.s) % keytransfer.subOrder),
+    }
+    assert keytransfer.sign("abc123", msg) == signer.sign(msg)
+    assert keytransfer.verify(signer.A, msg, signer.sign(msg))
+
+    # the nonce depends on the message, so two signatures don't reveal the key
+    sig1, sig2 = signer.sign(1), signer.sign(2)
+    assert sig1['R8'] != sig2['R8']
+    assert signer.nonce(1) != signer.nonce(2)
+    assert keytransfer.make_signer("other").nonce(1) != signer.nonce(1)
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+from common_utils_py.utils import keytransfer
+from common_utils_py.utils.prover_pool import ProverPool
+
+ZKEY = "/usr/local/share/keytransfer/keytransfer.zkey"
+DAT = "/usr/local/share/keytransfer/keytransfer.dat"
+
+
+def test_prover_pool():
+    data = b"123456789q01234567890q1234567890"
+    buyer_pub = keytransfer.mulPointEscalar(keytransfer.base8, 123)
+    with ProverPool(ZKEY, DAT, size=2) as pool:
+        res = keytransfer.prove_transfer(pool, buyer_pub, 234, data)
+        assert res['hash'] == keytransfer.hash_key(data)
+        assert pool.metrics()['completed'] == 1
+
+
+def test_prover_pool_metrics(monkeypatch):
+    monkeypatch.setattr(keytransfer, 'make_prover', lambda zkey, dat: object())
+    monkeypatch.setattr(keytransfer, 'prove', lambda prover, input: 'proof-%d' % input['n'])
+
+    with ProverPool(ZKEY, DAT, size=2) as pool:
+        futures = [pool.submit({'n': n}) for n in range(5)]
+        assert [f.result() for f in futures] == ['proof-%d' % n for n in range(5)]
+        assert asyncio.run(pool.prove_async({'n': 7})) == 'proof-7'
+        metrics = pool.metrics()
+    assert metrics['completed'] == 6
+    assert metrics['failed'] == 0
+    assert metrics['queue_depth'] == 0
+    assert metrics['running'] == 0
+
+    with ProverPool(ZKEY, DAT) as pool:
+        assert pool.metrics()['size'] == 1
+
+
+def test_finish_proof(monkeypatch):
+    threads = []
+
+    def prove(prover, input):
+        threads.append(threading.current_thread().name)
+        return '%s-%s' % (prover, input['buyer_x'])
+
+    monkeypatch.setattr(keytransfer, 'make_prover', lambda zkey, dat: 'pool')
+    monkeypatch.setattr(keytransfer, 'prove', prove)
+    monkeypatch.setattr(keytransfer, 'proof_executor', None)
+    buyer_pub = keytransfer.mulPointEscalar(keytransfer.base8, 123)
+    data = b"123456789q01234567890q1234567890"
+    prepared = keytransfer.prepare_transfer(buyer_pub, 234, data)
+    expected = '%s-' + prepared['snark_params']['buyer_x']
+
+    futures = [keytransfer.finish_proof('handle', prepared) for _ in range(3)]
+    assert [f.result() for f in futures] == [expected % 'handle'] * 3
+    executor = keytransfer.proof_executor
+    assert executor is not None
+    assert set(threads) == {'keytransfer-proof_0'}
+    executor.shutdown()
+
+    with ProverPool(ZKEY, DAT, size=2) as pool:
+        assert keytransfer.finish_proof(pool, prepared).result() == expected % 'pool'
+        assert pool.metrics()['completed'] == 1
+    assert keytransfer.proof_executor is executor